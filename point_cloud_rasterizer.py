@@ -0,0 +1,171 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# software point rasterizer for rendering without gpu (i.e. blender -b on machines without opengl), only numpy is used here,
+# output matches point cloud visualizer shaders: round points of given size in pixels, discarded outside of alpha radius,
+# the same illumination, and pixels as read back from opengl framebuffer, rgba uint8, bottom row first
+# when run as script with path to job json file, it renders frames of job in separate process, see render_job
+
+import os
+import sys
+import json
+import zlib
+import struct
+import numpy as np
+
+
+DEFAULT_COLOR = (0.65, 0.65, 0.65, 1.0, )
+
+
+def decode_normals(ns):
+    # octahedral int16 normals to unit vectors, as normalized integer attribute decoded in vertex shader
+    e = np.maximum(ns.astype(np.float32) / 32767, -1.0, )
+    n = np.empty((len(e), 3, ), dtype=np.float32, )
+    n[:, :2] = e
+    n[:, 2] = 1.0 - np.abs(e).sum(axis=1)
+    neg = n[:, 2] < 0.0
+    if(neg.any()):
+        q = e[neg]
+        sign = np.where(q >= 0.0, 1.0, -1.0, )
+        n[neg, :2] = (1.0 - np.abs(q[:, ::-1])) * sign
+    l = np.sqrt((n * n).sum(axis=1))
+    l[l == 0.0] = 1.0
+    return n / l[:, np.newaxis]
+
+
+def shade(count, cs=None, ns=None, light=None, show_normals=False, ):
+    # float rgba colors of points, cs are uint8 rgba colors, ns octahedral normals, light is dict with light_direction, light_intensity,
+    # shadow_direction and shadow_intensity in object space as with shader uniforms, colors are not clamped yet
+    if(show_normals and ns is not None):
+        c = np.ones((count, 4, ), dtype=np.float32, )
+        c[:, :3] = decode_normals(ns)
+        return c
+    if(cs is not None):
+        c = cs.astype(np.float32) / 255
+    else:
+        c = np.empty((count, 4, ), dtype=np.float32, )
+        c[:] = DEFAULT_COLOR
+    if(light is not None and ns is not None):
+        n = decode_normals(ns)
+        l = np.maximum(np.dot(n, -np.asarray(light['light_direction'], dtype=np.float32, )), 0.0, )
+        s = np.maximum(np.dot(n, -np.asarray(light['shadow_direction'], dtype=np.float32, )), 0.0, )
+        # alpha of light and shadow is 1 and they cancel out
+        c[:, :3] += l[:, np.newaxis] * np.asarray(light['light_intensity'], dtype=np.float32, )
+        c[:, :3] -= s[:, np.newaxis] * np.asarray(light['shadow_intensity'], dtype=np.float32, )
+    return c
+
+
+def project(vs, matrix, width, height, ):
+    # window coordinates (x, y, ) in pixels, depth and mask of points inside clip volume, matrix is 4x4 perspective_matrix @ object_matrix
+    m = np.asarray(matrix, dtype=np.float64, )
+    p = np.dot(vs, m[:, :3].T) + m[:, 3]
+    w = p[:, 3]
+    inside = (w > 0.0)
+    for i in range(3):
+        inside &= (np.abs(p[:, i]) <= w)
+    p = p[inside]
+    w = p[:, 3]
+    x = (p[:, 0] / w + 1.0) * 0.5 * width
+    y = (p[:, 1] / w + 1.0) * 0.5 * height
+    z = (p[:, 2] / w + 1.0) * 0.5
+    return x, y, z, inside
+
+
+def rasterize(vs, cs, ns, matrix, width, height, point_size=3.0, alpha_radius=1.0, light=None, show_normals=False, ):
+    # render points to rgba uint8 pixels (height, width, 4, ), bottom row first, background is transparent black,
+    # nearest point wins in each pixel, as when points are drawn sorted far to near
+    pixels = np.zeros((height, width, 4, ), dtype=np.uint8, )
+    x, y, z, inside = project(vs, matrix, width, height, )
+    if(not len(z)):
+        return pixels
+    # near to far, point rank is its depth in z-buffer
+    order = np.argsort(z, kind='stable', )
+    x = x[order]
+    y = y[order]
+    index = np.flatnonzero(inside)[order]
+    
+    colors = shade(len(index), None if cs is None else cs[index], None if ns is None else ns[index], light, show_normals, )
+    colors = np.round(np.clip(colors, 0.0, 1.0, ) * 255).astype(np.uint8)
+    
+    # pixels with centers inside of point square, at most ceil(size) in each direction, first covered pixel of each point
+    size = max(float(point_size), 1.0, )
+    k = int(np.ceil(size))
+    x0 = x - size / 2
+    y0 = y - size / 2
+    i0 = np.ceil(x0 - 0.5).astype(np.int64)
+    j0 = np.ceil(y0 - 0.5).astype(np.int64)
+    
+    zbuffer = np.full(width * height, len(index), dtype=np.int64, )
+    rank = np.arange(len(index), dtype=np.int64, )
+    for dj in range(k):
+        j = j0 + dj
+        # point coordinates from -1 to 1 over point square, only distance from center matters, so direction of y is not important
+        cy = 2.0 * ((j + 0.5 - y0) / size) - 1.0
+        for di in range(k):
+            i = i0 + di
+            cx = 2.0 * ((i + 0.5 - x0) / size) - 1.0
+            ok = (i + 0.5 < x0 + size) & (j + 0.5 < y0 + size) & (i >= 0) & (i < width) & (j >= 0) & (j < height)
+            ok &= (cx * cx + cy * cy <= alpha_radius)
+            p = (j * width + i)[ok]
+            r = rank[ok]
+            # first point in each pixel is nearest one
+            p, first = np.unique(p, return_index=True, )
+            r = r[first]
+            closer = r < zbuffer[p]
+            zbuffer[p[closer]] = r[closer]
+    
+    hit = np.flatnonzero(zbuffer < len(index))
+    pixels.reshape(-1, 4, )[hit] = colors[zbuffer[hit]]
+    return pixels
+
+
+def write_png(filepath, pixels, level=6, ):
+    # encode rgba uint8 array (height, width, 4, ), bottom row first, to 8 bit png file, rows are flipped to top first
+    h, w, _ = pixels.shape
+    raw = np.zeros((h, 1 + w * 4, ), dtype=np.uint8, )
+    # filter type 0 (none) byte at start of each row
+    raw[:, 1:] = pixels[::-1].reshape(h, w * 4, )
+    
+    def chunk(tag, data, ):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+    
+    d = os.path.dirname(filepath)
+    if(d != '' and not os.path.exists(d)):
+        os.makedirs(d)
+    with open(filepath, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 6, 0, 0, 0, )))
+        f.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), level, )))
+        f.write(chunk(b'IEND', b''))
+
+
+def render_job(job, ):
+    # render frames of job dict to png files, point arrays are .npy files memory mapped by all workers, so they are not copied to each
+    # job: {'arrays': {'vertices': path, 'colors': path or None, 'normals': path or None, }, 'width': int, 'height': int,
+    #       'frames': [{'filepath': path, 'matrix': 16 floats row by row, 'point_size': float, 'alpha_radius': float,
+    #                   'light': dict or None, 'show_normals': bool, }, ..., ], }
+    a = {k: None if v is None else np.load(v, mmap_mode='r', ) for k, v in job['arrays'].items()}
+    for f in job['frames']:
+        pixels = rasterize(a['vertices'], a['colors'], a['normals'], np.array(f['matrix'], dtype=np.float64, ).reshape(4, 4, ), job['width'], job['height'],
+                           f['point_size'], f['alpha_radius'], f['light'], f['show_normals'], )
+        write_png(f['filepath'], pixels, )
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1], 'r') as f:
+        render_job(json.load(f))
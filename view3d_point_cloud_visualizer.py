@@ -29,25 +29,39 @@ bl_info = {"name": "Point Cloud Visualizer",
 
 
 import os
+import sys
 import struct
+import tempfile
+import subprocess
 import uuid
 import time
 import datetime
 import math
+import json
+import shutil
+import hashlib
+import threading
+import collections
+import csv
+import platform
 import numpy as np
 
 import bpy
-from bpy.props import PointerProperty, BoolProperty, StringProperty, FloatProperty, IntProperty, FloatVectorProperty
-from bpy.types import PropertyGroup, Panel, Operator
+from bpy.props import PointerProperty, BoolProperty, StringProperty, FloatProperty, IntProperty, FloatVectorProperty, EnumProperty
+from bpy.types import PropertyGroup, Panel, Operator, AddonPreferences
 import gpu
-from gpu.types import GPUOffScreen, GPUShader, GPUBatch, GPUVertBuf, GPUVertFormat
-from gpu_extras.batch import batch_for_shader
+from gpu.types import GPUOffScreen, GPUShader, GPUBatch, GPUVertBuf, GPUVertFormat, GPUIndexBuf
 from bpy.app.handlers import persistent
 import bgl
 from mathutils import Matrix, Vector
 from bpy_extras.object_utils import world_to_camera_view
 from bpy_extras.io_utils import axis_conversion
 
+try:
+    from . import point_cloud_rasterizer
+except ImportError:
+    import point_cloud_rasterizer
+
 
 DEBUG = False
 
@@ -68,6 +82,65 @@ def human_readable_number(num, suffix='', ):
     return "{:.1f}{}{}".format(num, 'Y', suffix)
 
 
+class PCVStats():
+    # timing of stages and counters for tracking performance, stages are recorded from loader threads as well
+    # stage name: [calls, total seconds, last seconds, items (i.e. points), ]
+    stages = collections.OrderedDict()
+    # counter name: value
+    counters = collections.OrderedDict()
+    lock = threading.Lock()
+    
+    @classmethod
+    def record(cls, name, seconds, items=0, ):
+        with cls.lock:
+            s = cls.stages.setdefault(name, [0, 0.0, 0.0, 0, ])
+            s[0] += 1
+            s[1] += seconds
+            s[2] = seconds
+            s[3] += items
+    
+    @classmethod
+    def count(cls, name, n=1, ):
+        with cls.lock:
+            cls.counters[name] = cls.counters.get(name, 0) + n
+    
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.stages.clear()
+            cls.counters.clear()
+    
+    @classmethod
+    def report(cls):
+        # all numbers as dict, times in seconds
+        with cls.lock:
+            stages = collections.OrderedDict()
+            for k, (n, t, l, i) in cls.stages.items():
+                stages[k] = {'calls': n, 'total': t, 'last': l, 'average': t / max(n, 1), 'items': i, }
+            return {'stages': stages, 'counters': dict(cls.counters), }
+    
+    @classmethod
+    def export(cls, filepath, ):
+        # write report to .csv (stage per row, counters after) or .json file, with versions to compare results across addon versions and hardware
+        r = cls.report()
+        info = {'addon': ".".join([str(i) for i in bl_info['version']]), 'blender': bpy.app.version_string, 'platform': platform.platform(), 'time': datetime.datetime.now().isoformat(), }
+        if(os.path.splitext(filepath)[1].lower() == '.csv'):
+            with open(filepath, 'w', newline='', ) as f:
+                w = csv.writer(f)
+                for k, v in info.items():
+                    w.writerow(['#', k, v, ])
+                w.writerow(['stage', 'calls', 'total', 'last', 'average', 'items', ])
+                for k, v in r['stages'].items():
+                    w.writerow([k, v['calls'], v['total'], v['last'], v['average'], v['items'], ])
+                w.writerow(['counter', 'value', ])
+                for k, v in r['counters'].items():
+                    w.writerow([k, v, ])
+        else:
+            r['info'] = info
+            with open(filepath, 'w') as f:
+                json.dump(r, f, indent=2, )
+
+
 class BinPlyPointCloudReader():
     def __init__(self, path, ):
         log("{}:".format(self.__class__.__name__), 0)
@@ -179,14 +252,27 @@ class PlyPointCloudReader():
     _supported_formats = ('binary_little_endian', 'binary_big_endian', 'ascii', )
     _supported_versions = ('1.0', )
     _byte_order = {'binary_little_endian': '<', 'binary_big_endian': '>', 'ascii': None, }
-    _types = {'char': 'c', 'uchar': 'B', 'short': 'h', 'ushort': 'H', 'int': 'i', 'uint': 'I', 'float': 'f', 'double': 'd', }
+    _types = {'char': 'b', 'uchar': 'B', 'short': 'h', 'ushort': 'H', 'int': 'i', 'uint': 'I', 'float': 'f', 'double': 'd',
+              'int8': 'b', 'uint8': 'B', 'int16': 'h', 'uint16': 'H', 'int32': 'i', 'uint32': 'I', 'float32': 'f', 'float64': 'd', }
     
-    def __init__(self, path, ):
+    _ascii_chunk_size = 2 ** 24
+    # bytes of possible record starts examined at once when list lengths vary and markers of record ends which cannot be followed
+    _scan_block = 2 ** 18
+    _truncated = 2 ** 62
+    _negative = 2 ** 62 + 1
+    
+    def __init__(self, path, mmap=False, progress=None, chunk=None, ):
         log("{}:".format(self.__class__.__name__), 0)
         if(os.path.exists(path) is False or os.path.isdir(path) is True):
             raise OSError("did you point me to an imaginary file? ('{}')".format(path))
         
         self.path = path
+        # binary files only: map vertex element directly from file instead of reading it to new buffer
+        self._mmap = mmap
+        # optional callables, called with fraction of data read and with (points, start, end, ) when range of points is decoded
+        # ascii files only, binary are mapped at once
+        self._progress = progress
+        self._chunk = chunk
         log("will read file at: '{}'".format(self.path), 1)
         log("reading header..", 1)
         self._header()
@@ -266,9 +352,7 @@ class PlyPointCloudReader():
                         current_element['props'].append((n, self._types[c], self._types[t], ))
                 else:
                     _, t, n = l.split(' ')
-                    if(n == 'alpha'):
-                        # skip alpha, maybe use it in future versions, but now it is useless
-                        continue
+                    # alpha is kept even if it is not used, otherwise record size would not match data
                     if(self._ply_format == 'ascii'):
                         current_element['props'].append((n, self._types[t]))
                     else:
@@ -278,425 +362,2001 @@ class PlyPointCloudReader():
             else:
                 log('unknown header line: {}'.format(l))
         
+        self._header_length = sum([len(i) for i in raw])
+        if(self._ply_format != 'ascii'):
+            self._index()
+    
+    def _index(self):
+        # byte offset table of all elements, so any element can be read without reading elements before it
+        # elements with fixed size records are skipped by arithmetic, elements with list properties by scanning list lengths
+        self._file_size = os.path.getsize(self.path)
+        offset = self._header_length
+        for i, e in enumerate(self._elements):
+            e['offset'] = offset
+            e['dtype'] = None
+            e['size'] = None
+            if(not any([len(p) == 3 for p in e['props']])):
+                e['dtype'] = np.dtype([(p[0], '{}{}'.format(self._endianness, p[1]), ) for p in e['props']])
+                e['size'] = e['count'] * e['dtype'].itemsize
+            elif(i < len(self._elements) - 1):
+                self._scan_list_element(e)
+            else:
+                # last element, nothing behind it to skip to, scan only when it is requested
+                pass
+            if(e['size'] is None):
+                break
+            offset += e['size']
+    
+    def _scan_list_element(self, e, ):
+        # find byte size of element with list properties, if all lists in element have the same length (i.e. triangle faces), set record dtype as well
+        lists = [i for i, p in enumerate(e['props']) if len(p) == 3]
+        o = self._endianness
+        count = e['count']
+        remaining = self._file_size - e['offset']
+        if(count == 0 or remaining <= 0):
+            e['size'] = 0
+            return
+        buf = np.memmap(self.path, dtype=np.uint8, mode='r', offset=e['offset'], )
+        # (dtype of property or list count, list item size or None, )
+        props = [(np.dtype('{}{}'.format(o, p[1])), np.dtype(p[2]).itemsize if len(p) == 3 else None, ) for p in e['props']]
+        
+        if(len(lists) == 1):
+            # assume all records have list length of the first one and verify all their list counts at once
+            li = lists[0]
+            prefix = sum([d.itemsize for d, _ in props[:li]])
+            suffix = sum([d.itemsize for d, _ in props[li + 1:]])
+            cdt, isz = props[li]
+            if(prefix + cdt.itemsize <= len(buf)):
+                n = int(np.frombuffer(buf, dtype=cdt, count=1, offset=prefix, )[0])
+                step = prefix + cdt.itemsize + n * isz + suffix
+                if(n >= 0 and count * step <= len(buf)):
+                    counts = np.ndarray(shape=(count, ), dtype=cdt, buffer=buf, offset=prefix, strides=(step, ), )
+                    if((counts == n).all()):
+                        e['size'] = count * step
+                        dtp = []
+                        for p in e['props']:
+                            if(len(p) == 3):
+                                dtp.append(('{}_count'.format(p[0]), '{}{}'.format(o, p[1]), ))
+                                dtp.append((p[0], '{}{}'.format(o, p[2]), (n, ), ))
+                            else:
+                                dtp.append((p[0], '{}{}'.format(o, p[1]), ))
+                        e['dtype'] = np.dtype(dtp)
+                        return
+        
+        # list lengths vary, end of record is computed for every byte offset of block as if record started there
+        # and records are followed from start of block by binary lifting, so each block takes only few passes over its offsets
+        pos = 0
+        done = 0
+        while(done < count):
+            w = int(min(self._scan_block, len(buf) - pos, ))
+            if(w <= 0):
+                raise ValueError("element '{}' is longer than file".format(e['type']))
+            ends = self._record_ends(buf, pos, w, props, )
+            p, k = self._follow_records(ends, w, count - done, )
+            if(k < count - done):
+                # record ending outside of block
+                p = int(ends[p])
+                k += 1
+            if(p == self._negative):
+                raise ValueError("negative list length in element '{}'".format(e['type']))
+            if(p == self._truncated or pos + p > len(buf)):
+                raise ValueError("element '{}' is longer than file".format(e['type']))
+            pos += p
+            done += k
+        e['size'] = pos
+    
+    def _record_ends(self, buf, pos, w, props, ):
+        # end offsets relative to pos of records starting at each of w bytes from pos, records not fitting into file and records
+        # with negative list length are marked, list counts are gathered byte by byte, because records are not aligned
+        off = np.arange(pos, pos + w, dtype=np.int64, )
+        truncated = np.zeros(w, dtype=bool, )
+        negative = np.zeros(w, dtype=bool, )
+        for d, isz in props:
+            if(isz is None):
+                off += d.itemsize
+                continue
+            ok = off + d.itemsize <= len(buf)
+            truncated |= ~ok
+            at = np.where(ok, off, 0, )
+            n = buf[at[:, np.newaxis] + np.arange(d.itemsize, )].view(d)[:, 0].astype(np.int64)
+            negative |= (n < 0)
+            off += d.itemsize + np.maximum(n, 0, ) * isz
+        off -= pos
+        off[truncated] = self._truncated
+        off[negative] = self._negative
+        return off
+    
+    def _follow_records(self, ends, w, limit, ):
+        # (offset of record after at most limit records, number of records, ) following ends from offset 0 while records start inside block,
+        # table of each level jumps over twice as many records as previous one, block end w is where chains leave block
+        jump = np.empty(w + 1, dtype=np.int32, )
+        jump[:w] = np.minimum(ends, w, )
+        jump[w] = w
+        levels = [jump, ]
+        while(2 ** len(levels) <= min(limit, w, )):
+            jump = jump[jump]
+            levels.append(jump)
+        p = 0
+        k = 0
+        for i in reversed(range(len(levels))):
+            q = int(levels[i][p])
+            if(k + 2 ** i <= limit and q < w):
+                p = q
+                k += 2 ** i
+        return p, k
+    
+    def element(self, name, ):
+        # read single element from binary file, records of list elements must have the same length to fit into array
         if(self._ply_format == 'ascii'):
-            skip = False
-            flen = 0
-            hlen = 0
-            with open(self.path, mode='r', encoding='utf-8') as f:
-                for i, l in enumerate(f):
-                    flen += 1
-                    if(skip):
-                        continue
-                    hlen += 1
-                    if(l.rstrip() == 'end_header'):
-                        skip = True
-            self._header_length = hlen
-            self._file_length = flen
-        else:
-            self._header_length = sum([len(i) for i in raw])
+            raise TypeError("reading single element is supported only from binary ply files")
+        e = None
+        for a in self._elements:
+            if(a['type'] == name):
+                e = a
+                break
+        if(e is None):
+            raise KeyError("element '{}' not found".format(name))
+        if('offset' not in e):
+            raise ValueError("unable to locate element '{}'".format(name))
+        if(e['size'] is None):
+            self._scan_list_element(e)
+        dt = e['dtype']
+        if(dt is None):
+            raise TypeError("element '{}' has records of variable length".format(name))
+        if(e['count'] == 0):
+            return np.zeros(0, dtype=dt, )
+        if(self._mmap):
+            # read-only, pages are loaded by os when columns are actually accessed
+            return np.memmap(self.path, dtype=dt, mode='r', offset=e['offset'], shape=(e['count'], ), )
+        with open(self.path, mode='rb') as f:
+            f.seek(e['offset'])
+            return np.fromfile(f, dtype=dt, count=e['count'], )
     
     def _data_binary(self):
         self.points = []
-        
-        read_from = self._header_length
-        for ie, element in enumerate(self._elements):
-            if(element['type'] != 'vertex'):
-                continue
-            
-            dtp = []
-            for i, p in enumerate(element['props']):
-                n, t = p
-                dtp.append((n, '{}{}'.format(self._endianness, t), ))
-            dt = np.dtype(dtp)
-            with open(self.path, mode='rb') as f:
-                f.seek(read_from)
-                a = np.fromfile(f, dtype=dt, count=element['count'], )
-            
-            # self._stream.seek(read_from)
-            # a = np.fromfile(self._stream, dtype=dt, count=element['count'], )
-            
-            self.points = a
-            read_from += element['count']
-        
-        # self._stream.close()
+        for e in self._elements:
+            if(e['type'] == 'vertex'):
+                self.points = self.element('vertex')
     
     def _data_ascii(self):
+        # single pass over file in fixed size chunks, each chunk is converted at once with numpy
+        # incomplete line at the end of chunk is carried over to next one
         self.points = []
         
-        skip_header = self._header_length
-        skip_footer = self._file_length - self._header_length
-        for ie, element in enumerate(self._elements):
-            if(element['type'] != 'vertex'):
-                continue
-            
-            skip_footer = skip_footer - element['count']
-            with open(self.path, mode='r', encoding='utf-8') as f:
-                a = np.genfromtxt(f, dtype=np.dtype(element['props']), skip_header=skip_header, skip_footer=skip_footer, )
-            self.points = a
-            skip_header += element['count']
+        skip = 0
+        element = None
+        for e in self._elements:
+            if(e['type'] == 'vertex'):
+                element = e
+                break
+            # one record per line, lines of preceding elements are skipped
+            skip += e['count']
+        if(element is None):
+            return
+        if(any([len(p) == 3 for p in element['props']])):
+            raise TypeError("list properties in vertex element are not supported")
+        
+        count = element['count']
+        names = [p[0] for p in element['props']]
+        a = np.empty(count, dtype=np.dtype(element['props']), )
+        self.points = a
+        
+        done = 0
+        rest = b''
+        with open(self.path, mode='rb') as f:
+            f.seek(self._header_length)
+            while(done < count):
+                chunk = f.read(self._ascii_chunk_size)
+                eof = (len(chunk) < self._ascii_chunk_size)
+                data = rest + chunk
+                if(eof):
+                    if(not data.endswith(b'\n')):
+                        data += b'\n'
+                    block = data
+                    rest = b''
+                else:
+                    cut = data.rfind(b'\n') + 1
+                    block = data[:cut]
+                    rest = data[cut:]
+                
+                if(skip):
+                    n = block.count(b'\n')
+                    if(n <= skip):
+                        skip -= n
+                        block = b''
+                    else:
+                        block = block[self._nth_newline(block, skip) + 1:]
+                        skip = 0
+                
+                n = block.count(b'\n')
+                if(n > count - done):
+                    # following element starts in this chunk
+                    block = block[:self._nth_newline(block, count - done) + 1]
+                    n = count - done
+                
+                if(n):
+                    v = np.fromstring(block, dtype=np.float64, sep=' ', )
+                    if(len(v) != n * len(names)):
+                        raise ValueError("unexpected number of values in vertex element near vertex {}".format(done))
+                    v.shape = (n, len(names))
+                    for i, nm in enumerate(names):
+                        a[nm][done:done + n] = v[:, i]
+                    if(self._chunk is not None):
+                        self._chunk(a, done, done + n, )
+                    done += n
+                
+                if(eof and done < count):
+                    raise ValueError("file ended after {} of {} vertices".format(done, count))
+                if(self._progress is not None):
+                    self._progress(done / count)
+    
+    @staticmethod
+    def _nth_newline(block, n, ):
+        # position of n-th newline (counted from 1) in bytes
+        nl = np.flatnonzero(np.frombuffer(block, dtype=np.uint8, ) == ord('\n'))
+        return int(nl[n - 1])
+    
+    def column(self, name, ):
+        # read-only view of single vertex property, data is copied only when caller indexes it
+        a = self.points[name]
+        if(a.flags.writeable):
+            a = a.view()
+            a.flags.writeable = False
+        return a
+
+
+def benchmark_ascii_ply(n=2 ** 20, ):
+    # compare np.genfromtxt over whole file used before with chunked parser on temporary ascii file with positions, normals and colors,
+    # run from blender python console to measure with bundled numpy, returns dict with results
+    rng = np.random.RandomState(0)
+    vs = rng.uniform(-100.0, 100.0, (n, 3, ), )
+    ns = rng.uniform(-1.0, 1.0, (n, 3, ), )
+    cs = rng.randint(0, 256, (n, 3, ), )
+    props = [('x', 'f4', ), ('y', 'f4', ), ('z', 'f4', ), ('nx', 'f4', ), ('ny', 'f4', ), ('nz', 'f4', ), ('red', 'u1', ), ('green', 'u1', ), ('blue', 'u1', ), ]
+    
+    d = tempfile.mkdtemp(prefix='pcv_', )
+    try:
+        path = os.path.join(d, 'benchmark.ply')
+        with open(path, 'wb') as f:
+            h = ["ply", "format ascii 1.0", "element vertex {}".format(n), ]
+            h += ["property {} {}".format({'f4': 'float', 'u1': 'uchar', }[t], k) for k, t in props]
+            h += ["end_header", ""]
+            f.write("\n".join(h).encode('ascii'))
+            np.savetxt(f, np.column_stack((vs, ns, cs, )), fmt=['%.6f'] * 6 + ['%d'] * 3, )
+        
+        t = time.time()
+        reader = PlyPointCloudReader(path)
+        a = reader.points
+        chunked = time.time() - t
+        
+        t = time.time()
+        with open(path, mode='r', encoding='utf-8') as f:
+            b = np.genfromtxt(f, dtype=np.dtype(props), skip_header=len(props) + 4, )
+        genfromtxt = time.time() - t
+        
+        same = all([np.array_equal(a[k], b[k]) for k, _ in props])
+    finally:
+        shutil.rmtree(d, ignore_errors=True, )
+    
+    r = {'points': n, 'genfromtxt': genfromtxt, 'chunked': chunked, 'speedup': genfromtxt / max(chunked, 1e-9), 'same': same, }
+    log("benchmark_ascii_ply: {}".format(r))
+    return r
 
 
 class PCVShaders():
+    # variants are selected by defines, USE_NORMALS and USE_VCOLS enable normal and color vertex attributes, without them constants are used
+    # USE_ILLUMINATION shades by normals, SHOW_NORMALS displays normals as colors, USE_QUANTIZED expects normalized 16 bit positions relative to chunk bounding box,
+    # transformed by chunk_matrix which replaces perspective_matrix and object_matrix, it is composed in double precision, so large coordinates stay precise
     vertex_shader = '''
         in vec3 position;
-        in vec3 normal;
-        in vec4 color;
-        
-        uniform float show_illumination;
-        uniform vec3 light_direction;
-        uniform vec3 light_intensity;
-        uniform vec3 shadow_direction;
-        uniform vec3 shadow_intensity;
-        uniform float show_normals;
-        
+        #ifdef USE_QUANTIZED
+        uniform mat4 chunk_matrix;
+        #else
         uniform mat4 perspective_matrix;
         uniform mat4 object_matrix;
+        #endif
+        #ifdef USE_NORMALS
+        in vec2 normal;
+        #endif
+        #ifdef USE_VCOLS
+        in vec4 color;
+        #endif
+        
         uniform float point_size;
-        uniform float alpha_radius;
         
         out vec4 f_color;
-        out float f_alpha_radius;
         out vec3 f_normal;
         
-        out vec3 f_light_direction;
-        out vec3 f_light_intensity;
-        out vec3 f_shadow_direction;
-        out vec3 f_shadow_intensity;
-        out float f_show_normals;
-        out float f_show_illumination;
+        vec3 octahedral_decode(vec2 e)
+        {
+            vec3 n = vec3(e.xy, 1.0f - abs(e.x) - abs(e.y));
+            if(n.z < 0.0f){
+                vec2 s = vec2(n.x >= 0.0f ? 1.0f : -1.0f, n.y >= 0.0f ? 1.0f : -1.0f);
+                n.xy = (1.0f - abs(n.yx)) * s;
+            }
+            return normalize(n);
+        }
         
         void main()
         {
+            #ifdef USE_QUANTIZED
+            gl_Position = chunk_matrix * vec4(position, 1.0f);
+            #else
             gl_Position = perspective_matrix * object_matrix * vec4(position, 1.0f);
+            #endif
             gl_PointSize = point_size;
-            f_normal = normal;
+            #ifdef USE_NORMALS
+            f_normal = octahedral_decode(normal);
+            #else
+            f_normal = vec3(0.0f, 0.0f, 1.0f);
+            #endif
+            #ifdef USE_VCOLS
             f_color = color;
-            f_alpha_radius = alpha_radius;
-            
-            // f_light_direction = normalize(vec3(inverse(object_matrix) * vec4(light_direction, 1.0)));
-            f_light_direction = light_direction;
-            f_light_intensity = light_intensity;
-            // f_shadow_direction = normalize(vec3(inverse(object_matrix) * vec4(shadow_direction, 1.0)));
-            f_shadow_direction = shadow_direction;
-            f_shadow_intensity = shadow_intensity;
-            f_show_normals = show_normals;
-            f_show_illumination = show_illumination;
+            #else
+            f_color = vec4(0.65f, 0.65f, 0.65f, 1.0f);
+            #endif
         }
     '''
     fragment_shader = '''
         in vec4 f_color;
         in vec3 f_normal;
-        in float f_alpha_radius;
         
-        in vec3 f_light_direction;
-        in vec3 f_light_intensity;
-        in vec3 f_shadow_direction;
-        in vec3 f_shadow_intensity;
-        in float f_show_normals;
-        in float f_show_illumination;
+        uniform float alpha_radius;
+        #ifdef USE_ILLUMINATION
+        uniform vec3 light_direction;
+        uniform vec3 light_intensity;
+        uniform vec3 shadow_direction;
+        uniform vec3 shadow_intensity;
+        #endif
         
         out vec4 fragColor;
         
         void main()
         {
-            float r = 0.0f;
-            float a = 1.0f;
             vec2 cxy = 2.0f * gl_PointCoord - 1.0f;
-            r = dot(cxy, cxy);
-            if(r > f_alpha_radius){
+            if(dot(cxy, cxy) > alpha_radius){
                 discard;
             }
-            // fragColor = f_color * a;
-            
-            vec4 col;
-            if(f_show_normals > 0.5){
-                col = vec4(f_normal, 1.0) * a;
-            }else if(f_show_illumination > 0.5){
-                vec4 light = vec4(max(dot(f_light_direction, -f_normal), 0) * f_light_intensity, 1);
-                vec4 shadow = vec4(max(dot(f_shadow_direction, -f_normal), 0) * f_shadow_intensity, 1);
-                col = (f_color + light - shadow) * a;
-            }else{
-                col = f_color * a;
-            }
-            fragColor = col;
+            #if defined(SHOW_NORMALS)
+            fragColor = vec4(f_normal, 1.0);
+            #elif defined(USE_ILLUMINATION)
+            vec4 light = vec4(max(dot(light_direction, -f_normal), 0) * light_intensity, 1);
+            vec4 shadow = vec4(max(dot(shadow_direction, -f_normal), 0) * shadow_intensity, 1);
+            fragColor = f_color + light - shadow;
+            #else
+            fragColor = f_color;
+            #endif
         }
     '''
+    # compiled variants shared by all clouds and renders
+    cache = {}
+    # id of shader: uniforms values last sent to it
+    owners = {}
+    
+    @classmethod
+    def get(cls, normals, vcols, quantized=False, illumination=False, show_normals=False, ):
+        # illumination and normals display are available only with normals and normals display replaces illumination
+        illumination = illumination and normals
+        show_normals = show_normals and illumination
+        if(show_normals):
+            illumination = False
+            vcols = False
+        k = (normals and (illumination or show_normals), vcols, quantized, illumination, show_normals, )
+        if(k not in cls.cache):
+            cls.cache[k] = cls.new(*k)
+        return cls.cache[k]
+    
+    @classmethod
+    def new(cls, normals, vcols, quantized=False, illumination=False, show_normals=False, ):
+        d = ""
+        if(quantized):
+            d += "#define USE_QUANTIZED\n"
+        if(normals):
+            d += "#define USE_NORMALS\n"
+        if(vcols):
+            d += "#define USE_VCOLS\n"
+        if(illumination):
+            d += "#define USE_ILLUMINATION\n"
+        if(show_normals):
+            d += "#define SHOW_NORMALS\n"
+        return GPUShader(cls.vertex_shader, cls.fragment_shader, defines=d, )
+    
+    @classmethod
+    def clear(cls):
+        cls.cache = {}
+        cls.owners = {}
 
 
-def load_ply_to_cache(operator, context, ):
-    pcv = context.object.point_cloud_visualizer
-    filepath = pcv.filepath
+def light_vectors(pcv, matrix_world, ):
+    # light and shadow directions in object space and intensities for shader with illumination
+    cm = Matrix(((-1.0, 0.0, 0.0, 0.0, ), (0.0, -0.0, 1.0, 0.0, ), (0.0, -1.0, -0.0, 0.0, ), (0.0, 0.0, 0.0, 1.0, ), ))
+    _, obrot, _ = matrix_world.decompose()
+    mr = obrot.to_matrix().to_4x4()
+    mr.invert()
+    direction = cm @ pcv.light_direction
+    direction = mr @ direction
+    
+    inverted_direction = direction.copy()
+    inverted_direction.negate()
+    
+    c = pcv.light_intensity
+    s = pcv.shadow_intensity
+    return {'light_direction': direction,
+            'light_intensity': (c, c, c, ),
+            'shadow_direction': inverted_direction,
+            'shadow_intensity': (s, s, s, ), }
+
+
+def light_uniforms(shader, pcv, o, ):
+    for k, v in light_vectors(pcv, o.matrix_world, ).items():
+        shader.uniform_float(k, v)
+
+
+def object_uniforms(pcv, o, point_size, light, quantized=False, ):
+    # uniform values which change only with object transform or properties, light vectors only for shader with illumination,
+    # object matrix of quantized points is part of chunk matrices
+    u = {'point_size': point_size,
+         'alpha_radius': pcv.alpha_radius, }
+    if(not quantized):
+        u['object_matrix'] = o.matrix_world.copy()
+    if(light):
+        u.update(light_vectors(pcv, o.matrix_world, ))
+    return u
+
+
+def octahedral_encode(ns):
+    # unit vectors to two int16 components, normals are decoded in vertex shader
+    ns = np.asarray(ns, dtype=np.float32, )
+    s = np.abs(ns).sum(axis=1)
+    s[s == 0.0] = 1.0
+    p = ns[:, :2] / s[:, np.newaxis]
+    neg = ns[:, 2] < 0.0
+    if(neg.any()):
+        q = p[neg]
+        sign = np.where(q >= 0.0, 1.0, -1.0, )
+        p[neg] = (1.0 - np.abs(q[:, ::-1])) * sign
+    return np.round(np.clip(p, -1.0, 1.0) * 32767).astype(np.int16)
+
+
+def vertex_buffer(vs, cs, ns, count=None, ):
+    # vertex buffer of first count points, float or quantized uint16 positions, normalized uint8 colors and octahedral int16 normals
+    # colors and normals are None if file does not have them and in that case are not in vertex format at all
+    if(count is None):
+        count = len(vs)
+    t = time.perf_counter()
+    f = GPUVertFormat()
+    if(vs.dtype == np.uint16):
+        f.attr_add(id="position", comp_type='U16', len=3, fetch_mode='INT_TO_FLOAT_UNIT', )
+    else:
+        f.attr_add(id="position", comp_type='F32', len=3, fetch_mode='FLOAT', )
+    if(cs is not None):
+        f.attr_add(id="color", comp_type='U8', len=4, fetch_mode='INT_TO_FLOAT_UNIT', )
+    if(ns is not None):
+        f.attr_add(id="normal", comp_type='I16', len=2, fetch_mode='INT_TO_FLOAT_UNIT', )
+    vbo = GPUVertBuf(len=count, format=f, )
+    vbo.attr_fill(id="position", data=vs[:count], )
+    if(cs is not None):
+        vbo.attr_fill(id="color", data=cs[:count], )
+    if(ns is not None):
+        vbo.attr_fill(id="normal", data=ns[:count], )
+    PCVStats.record('upload', time.perf_counter() - t, count, )
+    return vbo
+
+
+def vertex_batch(vs, cs, ns, count=None, ):
+    # points batch of first count points, see vertex_buffer
+    return GPUBatch(type='POINTS', buf=vertex_buffer(vs, cs, ns, count, ), )
+
+
+def index_batch(vbo, start, count, ):
+    # points batch of count points of vertex buffer from start, only indices are uploaded
+    t = time.perf_counter()
+    ibo = GPUIndexBuf(type='POINTS', seq=np.arange(start, start + count, dtype=np.uint32, ), )
+    b = GPUBatch(type='POINTS', buf=vbo, elem=ibo, )
+    PCVStats.record('upload_indices', time.perf_counter() - t, count, )
+    return b
+
+
+def chunk_counts(chunks, ranks, count, ):
+    # number of displayed points in each chunk when first count points in display order are displayed, ranks are positions of points
+    # in global display order, each chunk is stable subsequence of it, so its displayed points are those with rank below count
+    if(count >= len(ranks)):
+        return chunks['count'].copy()
+    return np.array([np.searchsorted(ranks[a:a + k], count, ) for a, k in zip(chunks['start'], chunks['count'])], dtype=np.int64, )
+
+
+class PCVBatches():
+    # all points are uploaded once and shared by all objects showing the same file, displayed counts of each object are applied to chunks
+    # as draw range, on blender without GPUBatch.draw_range each chunk is single vertex buffer, fully drawn chunk is drawn with one call
+    # and its parts by batches with index buffers into it, displayed points by batch made when displayed count changes, points lowered
+    # by point budget by pages of indices shared by all counts and only small tail of the last page is made again when count changes,
+    # counts lowered by point budget are rounded up to whole pages there, so budget might be exceeded by less than page per chunk
+    page = 2 ** 14
+    
+    def __init__(self, vs, cs, ns, chunks, ):
+        self.vertices = vs
+        self.colors = cs
+        self.normals = ns
+        self.chunks = chunks
+        self.total = len(vs)
+        self.itemsize = sum([a[0].nbytes for a in (vs, cs, ns, ) if a is not None and len(a)])
+        self.transforms = chunk_transforms(chunks)
+        self.ranged = hasattr(GPUBatch, 'draw_range')
+        # batch with all points of each chunk, None for empty chunks
+        self.batches = []
+        self.buffers = []
+        for i in range(len(chunks)):
+            a = int(chunks['start'][i])
+            k = int(chunks['count'][i])
+            vbo = None
+            if(k):
+                vbo = vertex_buffer(vs[a:a + k], None if cs is None else cs[a:a + k], None if ns is None else ns[a:a + k], )
+            self.buffers.append(vbo)
+            self.batches.append(None if vbo is None else GPUBatch(type='POINTS', buf=vbo, ))
+        self.corners = chunk_corners(chunks)
+        # chunk index: {page index: batch, }, made when first drawn
+        self.pages = {}
+        # chunk index: (batch, points, ) with part of last page
+        self.tails = {}
+        # chunk index: (batch, points, ) with displayed points
+        self.displayed = {}
+        # number of chunks drawn last time
+        self.drawn = 0
+    
+    def nbytes(self):
+        # uploaded vertex data, all points, and indices of pages, current tails and displayed points
+        n = self.total * self.itemsize
+        n += sum([len(p) for p in self.pages.values()]) * self.page * 4
+        n += sum([k for _, k in self.tails.values()]) * 4
+        n += sum([k for _, k in self.displayed.values()]) * 4
+        return n
+    
+    def project(self, matrix, caps, ):
+        # (displayed counts caps with zeros for chunks outside of view frustum, projected areas of chunks, ), matrix is perspective @ object matrix
+        p = chunk_clip(self.corners, matrix, )
+        return np.where(chunk_visibility(p), caps, 0, ), chunk_screen_area(p)
+    
+    def draw(self, shader, quantized, counts, caps, matrix=None, ):
+        # counts of points to draw from each chunk, at most displayed counts caps, all displayed points if not given,
+        # quantized points need matrix, perspective @ object matrix as float64 array
+        if(counts is None):
+            counts = caps
+        self.drawn = int(np.count_nonzero(counts))
+        drawn = np.flatnonzero(counts)
+        if(quantized):
+            ms = matrix @ self.transforms[drawn]
+        calls = 0
+        for j, i in enumerate(drawn):
+            k = int(counts[i])
+            if(quantized):
+                shader.uniform_float("chunk_matrix", Matrix(ms[j].tolist()))
+            calls += 1
+            if(self.ranged):
+                self.batches[i].draw_range(shader, elem_start=0, elem_count=k, )
+                continue
+            if(k < caps[i]):
+                k = min(-(-k // self.page) * self.page, int(caps[i]), )
+            if(k == self.chunks['count'][i]):
+                self.batches[i].draw(shader)
+                continue
+            if(k == caps[i]):
+                if(i not in self.displayed or self.displayed[i][1] != k):
+                    self.displayed[i] = (index_batch(self.buffers[i], 0, k, ), k, )
+                self.displayed[i][0].draw(shader)
+                continue
+            n, r = divmod(k, self.page)
+            pages = self.pages.setdefault(i, {}, )
+            for p in range(n):
+                if(p not in pages):
+                    pages[p] = index_batch(self.buffers[i], p * self.page, self.page, )
+                pages[p].draw(shader)
+            calls += n - 1
+            if(r):
+                if(i not in self.tails or self.tails[i][1] != r):
+                    self.tails[i] = (index_batch(self.buffers[i], n * self.page, r, ), r, )
+                self.tails[i][0].draw(shader)
+                calls += 1
+        PCVStats.count('draw_calls', calls, )
+
+
+def chunk_corners(chunks, ):
+    # homogeneous coordinates of 8 bounding box corners of each chunk, shape (chunks, 8, 4)
+    s = np.array([[(i >> a) & 1 for a in range(3)] for i in range(8)], dtype=bool, )
+    c = np.ones((len(chunks), 8, 4, ), dtype=np.float64, )
+    c[:, :, :3] = np.where(s[np.newaxis], chunks['max'][:, np.newaxis], chunks['min'][:, np.newaxis], )
+    return c
+
+
+def chunk_clip(corners, matrix, ):
+    # clip space coordinates of all chunk corners at once
+    return corners @ np.array(matrix, dtype=np.float64, ).T
+
+
+def chunk_visibility(p, ):
+    # boolean mask of chunks with bounding box not completely outside of view frustum, p are clip space corners from chunk_clip,
+    # box is culled when all its corners are outside of the same clip plane, so boxes near frustum corners might be kept
+    w = p[:, :, 3]
+    outside = np.zeros(len(p), dtype=bool, )
+    for a in range(3):
+        outside |= (p[:, :, a] < -w).all(axis=1)
+        outside |= (p[:, :, a] > w).all(axis=1)
+    return ~outside
+
+
+def chunk_screen_area(p, ):
+    # area of chunk bounding box projected to normalized device coordinates and clipped to screen, 4.0 is whole screen,
+    # boxes with corner behind camera are taken as covering whole screen
+    w = p[:, :, 3]
+    behind = (w <= 0.0).any(axis=1)
+    w = np.where(w > 0.0, w, 1.0, )
+    x = np.clip(p[:, :, 0] / w, -1.0, 1.0, )
+    y = np.clip(p[:, :, 1] / w, -1.0, 1.0, )
+    a = (x.max(axis=1) - x.min(axis=1)) * (y.max(axis=1) - y.min(axis=1))
+    return np.where(behind, 4.0, a, )
+
+
+def budget_counts(caps, weights, budget, ):
+    # split budget of points proportionally to weights, no chunk gets more than its cap and points left by capped chunks go to others
+    caps = np.asarray(caps, dtype=np.int64, )
+    if(budget <= 0 or caps.sum() <= budget):
+        return caps
+    w = np.maximum(np.asarray(weights, dtype=np.float64, ), 1e-9, )
+    # find t for which sum of min(caps, t * w) is budget by bisection
+    lo = 0.0
+    hi = float((caps / w).max())
+    for i in range(48):
+        t = (lo + hi) / 2
+        if(np.minimum(caps, t * w, ).sum() > budget):
+            hi = t
+        else:
+            lo = t
+    return np.minimum(caps, (lo * w).astype(np.int64), )
+
+
+def display_index(chunks, ranks, count, ):
+    # indices of displayed points, the same points as drawn by PCVBatches
+    ks = chunk_counts(chunks, ranks, count, )
+    return np.concatenate([np.arange(a, a + k, dtype=np.int64, ) for a, k in zip(chunks['start'], ks)] + [np.zeros(0, dtype=np.int64, )])
+
+
+CHUNK_DTYPE = np.dtype([('start', np.int64, ), ('count', np.int64, ), ('min', np.float64, (3, ), ), ('max', np.float64, (3, ), ), ('error', np.float64, ), ])
+
+
+def octree_chunks(vs, max_points=2 ** 18, levels=16, ):
+    # split points into octree leaves with at most max_points points (unless they share single voxel of finest level)
+    # returns stable permutation grouping points by leaf, so display order is kept within each leaf, and chunk array
+    n = len(vs)
+    codes = morton_codes(vs, levels, )
+    sc = np.sort(codes, kind='mergesort', )
+    leaves = []
+    active = [(0, n, )]
+    level = 0
+    while(len(active)):
+        split = []
+        for a, b in active:
+            if(b - a <= max_points or level == levels):
+                leaves.append(a)
+                continue
+            # children are contiguous runs in morton order
+            key = sc[a:b] >> np.uint64(3 * (levels - level - 1))
+            starts = a + np.flatnonzero(np.concatenate(([True], key[1:] != key[:-1], )))
+            split.extend(zip(starts.tolist(), np.append(starts[1:], b).tolist(), ))
+        active = split
+        level += 1
+    leaves.sort()
+    
+    leaf = np.searchsorted(sc[leaves], codes, side='right', ) - 1
+    order = np.argsort(leaf, kind='mergesort', )
+    counts = np.bincount(leaf, minlength=len(leaves), )
+    chunks = np.zeros(len(leaves), dtype=CHUNK_DTYPE, )
+    chunks['count'] = counts
+    chunks['start'] = np.concatenate(([0], np.cumsum(counts)[:-1], ))
+    g = vs[order]
+    chunks['min'] = np.minimum.reduceat(g, chunks['start'], axis=0, )
+    chunks['max'] = np.maximum.reduceat(g, chunks['start'], axis=0, )
+    return order, chunks
+
+
+def quantize_positions(vs, chunks, out=None, ):
+    # positions as uint16 offsets within chunk bounding box, maximal error is stored in chunks['error'], it is measured
+    # with offsets decoded in float32 as in shader, chunk origin is added in double precision there (see chunk_transforms)
+    q = out
+    if(q is None):
+        q = np.empty(vs.shape, dtype=np.uint16, )
+    for i in range(len(chunks)):
+        a = chunks['start'][i]
+        b = a + chunks['count'][i]
+        lo = chunks['min'][i]
+        ext = chunk_scale(chunks[i:i + 1])[0]
+        v = np.round((vs[a:b] - lo) / ext * 65535)
+        q[a:b] = v
+        d = (v.astype(np.float32) / np.float32(65535)) * ext.astype(np.float32)
+        chunks['error'][i] = np.abs(lo + d - vs[a:b]).max() if b > a else 0.0
+    return q
+
+
+def dequantize_positions(q, chunks, ):
+    vs = np.empty(q.shape, dtype=np.float32, )
+    for i in range(len(chunks)):
+        a = chunks['start'][i]
+        b = a + chunks['count'][i]
+        vs[a:b] = chunks['min'][i] + q[a:b] / 65535 * chunk_scale(chunks[i:i + 1])[0]
+    return vs
+
+
+def chunk_scale(chunks, ):
+    ext = chunks['max'] - chunks['min']
+    ext[ext == 0.0] = 1.0
+    return ext
+
+
+def chunk_transforms(chunks, ):
+    # matrices from normalized quantized positions to object space, shape (chunks, 4, 4), float64
+    m = np.zeros((len(chunks), 4, 4, ), dtype=np.float64, )
+    ext = chunk_scale(chunks)
+    for a in range(3):
+        m[:, a, a] = ext[:, a]
+    m[:, :3, 3] = chunks['min']
+    m[:, 3, 3] = 1.0
+    return m
+
+
+def quantization_report(chunks, ):
+    # list of (points, bound, error, ) for each chunk, bound is half step of 16 bit grid along longest chunk axis plus float32 rounding
+    # of decoded offset, error is measured maximum of decoding as in shader
+    ext = (chunks['max'] - chunks['min']).max(axis=1)
+    bound = ext / 65535 / 2 + ext * np.finfo(np.float32).eps
+    return [(int(c), float(b), float(e), ) for c, b, e in zip(chunks['count'], bound, chunks['error'])]
+
+
+class PCVSidecarCache():
+    # processed arrays of loaded files stored as .npy files in cache directory, so next load is just memory map of them
+    # entry directory name is derived from file path and quantization, so both variants of the same file are kept,
+    # file size and modification time are stored with arrays and checked on load
+    # version has to be increased whenever stored arrays change
+    version = 8
+    # vertices, colors and normals are stored interleaved in buffer
+    arrays = ('buffer', 'order', 'ranks', 'chunks', )
     
-    __t = time.time()
+    @classmethod
+    def settings(cls):
+        p = preferences()
+        if(p is None):
+            return True, default_cache_directory(), 4096
+        d = p.cache_directory
+        if(d == ""):
+            d = default_cache_directory()
+        return p.cache_enabled, bpy.path.abspath(d), p.cache_size
+    
+    @classmethod
+    def _identity(cls, filepath, quantized, ):
+        # filepath must be absolute, this is called from loading thread where blender data should not be accessed
+        p = os.path.realpath(filepath)
+        st = os.stat(p)
+        k = hashlib.sha1(p.encode('utf-8')).hexdigest()
+        if(quantized):
+            k = "{}_q".format(k)
+        return k, {'path': p, 'size': st.st_size, 'mtime': st.st_mtime, 'version': cls.version, 'quantized': quantized, }
+    
+    @classmethod
+    def load(cls, filepath, directory, quantized, ):
+        k, meta = cls._identity(filepath, quantized, )
+        d = os.path.join(directory, k)
+        mp = os.path.join(d, 'meta.json')
+        if(not os.path.exists(mp)):
+            return None
+        try:
+            with open(mp, mode='r', encoding='utf-8') as f:
+                m = json.load(f)
+            for n in ('path', 'size', 'mtime', 'version', 'quantized', ):
+                if(m[n] != meta[n]):
+                    log("sidecar cache for '{}' is out of date".format(filepath))
+                    return None
+            a = {n: np.load(os.path.join(d, '{}.npy'.format(n)), mmap_mode='r', ) for n in cls.arrays}
+        except Exception as e:
+            log("sidecar cache for '{}' could not be read: {}".format(filepath, e))
+            return None
+        r = vertex_data(a['buffer'], a['order'], a['ranks'], a['chunks'], m['has_normals'], m['has_vcols'], m['quantized'], )
+        # mark as recently used for eviction, cache directory might be read-only (i.e. shared on render farm), then it is just not marked
+        try:
+            os.utime(mp, None)
+        except OSError:
+            pass
+        return r
+    
+    @classmethod
+    def save(cls, filepath, data, directory, size_limit, ):
+        k, meta = cls._identity(filepath, data['quantized'], )
+        meta['has_normals'] = data['has_normals']
+        meta['has_vcols'] = data['has_vcols']
+        d = os.path.join(directory, k)
+        # write into temporary directory and swap it in, so interrupted write never looks like valid entry
+        t = '{}.tmp{}'.format(d, os.getpid())
+        try:
+            if(os.path.exists(t)):
+                shutil.rmtree(t)
+            os.makedirs(t)
+            for n in cls.arrays:
+                np.save(os.path.join(t, '{}.npy'.format(n)), data[n], )
+            with open(os.path.join(t, 'meta.json'), mode='w', encoding='utf-8') as f:
+                json.dump(meta, f, )
+            if(os.path.exists(d)):
+                shutil.rmtree(d)
+            os.rename(t, d)
+        except Exception as e:
+            log("sidecar cache for '{}' could not be written: {}".format(filepath, e))
+            shutil.rmtree(t, ignore_errors=True, )
+            return False
+        cls.evict(directory, size_limit, keep=k, )
+        return True
+    
+    @classmethod
+    def evict(cls, directory, size_limit, keep=None, ):
+        # remove least recently used entries until cache directory fits into size limit (in megabytes)
+        entries = []
+        total = 0
+        for k in os.listdir(directory):
+            d = os.path.join(directory, k)
+            mp = os.path.join(d, 'meta.json')
+            if(not os.path.isdir(d) or not os.path.exists(mp)):
+                continue
+            s = sum([os.path.getsize(os.path.join(d, f)) for f in os.listdir(d)])
+            entries.append((os.path.getmtime(mp), s, k, ))
+            total += s
+        limit = size_limit * 1024 * 1024
+        for t, s, k in sorted(entries):
+            if(total <= limit):
+                break
+            if(k == keep):
+                continue
+            log("sidecar cache: evicting {}".format(k))
+            shutil.rmtree(os.path.join(directory, k), ignore_errors=True, )
+            total -= s
+
+
+def default_cache_directory():
+    # user_resource keyword arguments differ between blender versions, so directory is created here
+    d = os.path.join(bpy.utils.user_resource('DATAFILES'), "point_cloud_visualizer_cache", )
+    os.makedirs(d, exist_ok=True, )
+    return d
+
+
+def vertex_dtype(normals, vcols, quantized=False, ):
+    # interleaved vertex record, float32 or uint16 positions, uint8 rgba colors, octahedral int16 normals
+    # colors and normals are left out when file does not have them
+    dtp = [('position', np.uint16 if quantized else np.float32, (3, ), ), ]
+    if(vcols):
+        dtp.append(('color', np.uint8, (4, ), ))
+    if(normals):
+        dtp.append(('normal', np.int16, (2, ), ))
+    return np.dtype(dtp)
+
+
+def vertex_views(buffer, ):
+    # (vertices, colors, normals, ) strided views into interleaved buffer, None for missing attributes
+    names = buffer.dtype.names
+    return tuple([buffer[n] if n in names else None for n in ('position', 'color', 'normal', )])
+
+
+def fill_vertices(out, column, index, ):
+    # gather selected points straight into preallocated interleaved records, column is callable returning vertex property array by name
+    def put(dst, name, ):
+        src = column(name)
+        if(src.dtype == dst.dtype):
+            np.take(src, index, out=dst, mode='clip', )
+        else:
+            dst[:] = src[index]
+    
+    names = out.dtype.names
+    p = out['position']
+    for i, n in enumerate(('x', 'y', 'z', )):
+        put(p[:, i], n, )
+    if('color' in names):
+        c = out['color']
+        for i, n in enumerate(('red', 'green', 'blue', )):
+            put(c[:, i], n, )
+        c[:, 3] = 255
+    if('normal' in names):
+        out['normal'] = octahedral_encode(np.column_stack([column(n)[index] for n in ('nx', 'ny', 'nz', )]))
+
+
+def depth_order(vs, matrix, ):
+    # indices of points sorted far to near, matrix is 4x4 from object to camera space, camera looks along -z,
+    # only depth row of matrix is needed
+    m = np.array(matrix, dtype=np.float64, )
+    z = np.dot(vs, m[2, :3]) + m[2, 3]
+    return np.argsort(z, kind='stable', )
+
+
+def benchmark_depth_sort(scene, camera, matrix_world, n=2 ** 18, ):
+    # compare per point depth sort used before with depth_order on random points, run from blender python console with some camera
+    # and object matrix, returns dict with results, depths sorted by both orders should be the same
+    vs = np.random.uniform(-10.0, 10.0, (n, 3, ), ).astype(np.float32)
+    
+    t = time.time()
+    depth = []
+    for v in vs:
+        vw = matrix_world @ Vector(v)
+        depth.append(world_to_camera_view(scene, camera, vw)[2])
+    a = np.array(sorted(range(len(depth)), key=lambda i: depth[i]), dtype=np.int64, )[::-1]
+    loop = time.time() - t
+    
+    t = time.time()
+    b = depth_order(vs, camera.matrix_world.normalized().inverted() @ matrix_world, )
+    vectorized = time.time() - t
+    
+    depth = np.array(depth)
+    r = {'points': n, 'loop': loop, 'numpy': vectorized, 'speedup': loop / max(vectorized, 1e-9), 'same': bool(np.allclose(depth[a], depth[b], rtol=1e-5, atol=1e-5, )), }
+    log("benchmark_depth_sort: {}".format(r))
+    return r
+
+
+def benchmark_vertex_buffer(n=2 ** 22, ):
+    # compare separate column_stack arrays used before with interleaved buffer on random binary-like data, returns dict with results
+    # allocations are traced with tracemalloc, numpy reports its data buffers there
+    import tracemalloc
+    
+    dt = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('nx', '<f4'), ('ny', '<f4'), ('nz', '<f4'), ('red', 'u1'), ('green', 'u1'), ('blue', 'u1'), ])
+    points = np.zeros(n, dtype=dt, )
+    rng = np.random.RandomState(0)
+    for k in ('x', 'y', 'z', 'nx', 'ny', 'nz', ):
+        points[k] = rng.rand(n)
+    index = rng.permutation(n)
+    
+    def columns():
+        p = points[index]
+        vs = np.column_stack((p['x'], p['y'], p['z'], ))
+        ns = np.column_stack((p['nx'], p['ny'], p['nz'], ))
+        cs = np.column_stack((p['red'] / 255, p['green'] / 255, p['blue'] / 255, np.ones(len(p), dtype=float, ), )).astype(np.float32)
+        return vs, ns, cs
+    
+    def interleaved():
+        buffer = np.empty(n, dtype=vertex_dtype(True, True, ), )
+        fill_vertices(buffer, lambda k: points[k], index, )
+        return buffer
+    
+    r = {}
+    for name, fn in (('columns', columns, ), ('interleaved', interleaved, ), ):
+        tracemalloc.start()
+        t = time.time()
+        a = fn()
+        d = time.time() - t
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        r[name] = {'time': d, 'result_bytes': current, 'peak_bytes': peak, }
+        del a
+    r['peak_saved_bytes'] = r['columns']['peak_bytes'] - r['interleaved']['peak_bytes']
+    log("benchmark_vertex_buffer: {}".format(r))
+    return r
+
+
+def morton_codes(vs, bits, ):
+    # interleaved bits of integer grid coordinates of points normalized to bounding cube, bits per axis <= 21
+    lo = vs.min(axis=0)
+    extent = float((vs.max(axis=0) - lo).max())
+    if(extent == 0.0):
+        extent = 1.0
+    r = 2 ** bits
+    g = np.minimum(((vs - lo) * (r / extent)).astype(np.int64), r - 1).astype(np.uint64)
+    
+    def spread(v):
+        # insert two zero bits between each bit
+        v = (v | (v << np.uint64(32))) & np.uint64(0x1f00000000ffff)
+        v = (v | (v << np.uint64(16))) & np.uint64(0x1f0000ff0000ff)
+        v = (v | (v << np.uint64(8))) & np.uint64(0x100f00f00f00f00f)
+        v = (v | (v << np.uint64(4))) & np.uint64(0x10c30c30c30c30c3)
+        v = (v | (v << np.uint64(2))) & np.uint64(0x1249249249249249)
+        return v
+    
+    return (spread(g[:, 0]) << np.uint64(2)) | (spread(g[:, 1]) << np.uint64(1)) | spread(g[:, 2])
+
+
+def lod_order(vs, levels=16, seed=0, ):
+    # permutation putting points in breadth first order of voxel hierarchy, one point from each occupied voxel of coarsest grid first,
+    # then one from each voxel of twice finer grid not covered yet and so on, so prefix of any length covers whole scene evenly.
+    # within level points are in pseudo random order from fixed seed, result is the same on every run
+    n = len(vs)
+    priority = np.random.RandomState(seed).permutation(n)
+    
+    # points sorted along morton curve, so voxels of any level are contiguous runs
+    codes = morton_codes(vs, levels, )
+    ms = np.argsort(codes, kind='mergesort', )
+    codes = codes[ms]
+    ps = priority[ms]
+    # position in sorted arrays of point with given priority
+    position = np.empty(n, dtype=np.int64, )
+    position[ps] = np.arange(n)
+    
+    level = np.full(n, levels, dtype=np.int8, )
+    assigned = np.zeros(n, dtype=bool, )
+    for l in range(levels):
+        key = codes >> np.uint64(3 * (levels - l))
+        starts = np.flatnonzero(np.concatenate(([True], key[1:] != key[:-1], )))
+        covered = np.logical_or.reduceat(assigned, starts, )
+        if(covered.all()):
+            continue
+        # point with lowest priority from each voxel without point from coarser level
+        best = position[np.minimum.reduceat(np.where(assigned, n, ps), starts, )[~covered]]
+        level[best] = l
+        assigned[best] = True
+        if(assigned.all()):
+            break
+    
+    # by level, then by priority, stable sort of small integers is linear
+    by_priority = level[position]
+    return ms[position[np.argsort(by_priority, kind='mergesort', )]]
+
+
+def process_ply(filepath, progress=None, stream=None, stream_limit=2 ** 22, quantize=False, ):
+    # read ply file and prepare arrays in display order, only numpy is used here
+    # points are grouped to octree chunks, each in display order, if quantize is True, positions are stored as uint16 offsets in chunk
+    # stream is optional callable receiving (vertices, colors, normals, ) of points decoded so far, about stream_limit points in total,
+    # ascii files are streamed in file order while parsing, every n-th line, binary files before reordering, as strided subsets of
+    # memory mapped records, coarse first and then in between, so first points are drawn right after file is mapped
+    def step(f):
+        if(progress is not None):
+            progress(f)
+    
+    def features(names):
+        return set(('nx', 'ny', 'nz')).issubset(names), set(('red', 'green', 'blue')).issubset(names)
+    
+    def preview(points, start, end, ):
+        if(stream is None or not set(('x', 'y', 'z')).issubset(points.dtype.names)):
+            return
+        nth = int(math.ceil(len(points) / stream_limit))
+        index = np.arange(start + (-start % nth), end, nth, )
+        if(len(index)):
+            b = np.empty(len(index), dtype=vertex_dtype(*features(points.dtype.names)), )
+            fill_vertices(b, lambda n: points[n], index, )
+            stream(*vertex_views(b))
     
     log('load data..')
     _t = time.time()
     
-    points = []
-    try:
-        # points = BinPlyPointCloudReader(filepath).points
-        points = PlyPointCloudReader(filepath).points
-    except Exception as e:
-        if(operator is not None):
-            operator.report({'ERROR'}, str(e))
-        else:
-            raise e
+    reader = PlyPointCloudReader(filepath, mmap=True, progress=lambda f: step(f * 0.5), chunk=preview, )
+    points = reader.points
     if(len(points) == 0):
-        operator.report({'ERROR'}, "No vertices loaded from file at {}".format(filepath))
-        return False
+        raise ValueError("No vertices loaded from file at {}".format(filepath))
     
+    PCVStats.record('parse', time.time() - _t, len(points), )
     _d = datetime.timedelta(seconds=time.time() - _t)
     log("completed in {}.".format(_d))
     
-    log('shuffle data..')
+    log('reorder data..')
     _t = time.time()
     
-    np.random.shuffle(points)
+    if(not set(('x', 'y', 'z')).issubset(points.dtype.names)):
+        # this is very unlikely..
+        raise ValueError("Loaded data seems to miss vertex locations.")
+    
+    normals, vcols = features(points.dtype.names)
+    n = len(points)
+    
+    # stream every nth point, first every (nth * 2 ** k)th and then points in between with halved stride, each point once
+    if(stream is not None and reader._ply_format != 'ascii'):
+        nth = int(math.ceil(n / stream_limit))
+        stride = nth
+        while(n // stride > 2 ** 16):
+            stride *= 2
+        blocks = [np.arange(0, n, stride, )]
+        while(stride > nth):
+            blocks.append(np.arange(stride // 2, n, stride, ))
+            stride //= 2
+        for index in blocks:
+            if(len(index)):
+                b = np.empty(len(index), dtype=vertex_dtype(normals, vcols, ), )
+                fill_vertices(b, reader.column, index, )
+                stream(*vertex_views(b))
+    
+    # reorder only index, points might be read-only memory map, columns are gathered in display order below
+    xyz = np.column_stack((reader.column('x'), reader.column('y'), reader.column('z'), ))
+    order = lod_order(xyz)
+    
+    # octree chunks for view frustum culling, display order is kept within each chunk,
+    # position of each point in global display order is kept to display the same points as without chunks
+    xyz = xyz[order]
+    perm, chunks = octree_chunks(xyz)
+    order = order[perm]
+    ranks = perm.astype(np.uint32 if n < 2 ** 32 else np.int64)
+    if(quantize):
+        # positions in source precision and final order are quantized below, not float32 copies
+        xyz = xyz[perm]
+    else:
+        del xyz
+    del perm
+    step(0.6)
     
+    PCVStats.record('reorder', time.time() - _t, n, )
     _d = datetime.timedelta(seconds=time.time() - _t)
     log("completed in {}.".format(_d))
     
     log('process data..')
     _t = time.time()
     
-    if(not set(('x', 'y', 'z')).issubset(points.dtype.names)):
-        # this is very unlikely..
-        operator.report({'ERROR'}, "Loaded data seems to miss vertex locations.")
-        return False
-    normals = True
-    if(not set(('nx', 'ny', 'nz')).issubset(points.dtype.names)):
-        normals = False
-    pcv.has_normals = normals
-    if(not pcv.has_normals):
-        pcv.light_enabled = False
-    vcols = True
-    if(not set(('red', 'green', 'blue')).issubset(points.dtype.names)):
-        vcols = False
-    pcv.has_vcols = vcols
-    
-    vs = np.column_stack((points['x'], points['y'], points['z'], ))
+    buffer = np.empty(n, dtype=vertex_dtype(normals, vcols, ), )
+    i = 0
+    while(i < n):
+        j = min(n, i + 2 ** 21)
+        fill_vertices(buffer[i:j], reader.column, order[i:j], )
+        i = j
+        step(0.6 + 0.4 * (i / n))
+    
+    if(quantize):
+        q = np.empty(n, dtype=vertex_dtype(normals, vcols, True, ), )
+        quantize_positions(xyz, chunks, out=q['position'], )
+        del xyz
+        for k in buffer.dtype.names[1:]:
+            q[k] = buffer[k]
+        buffer = q
+        for i, r in enumerate(quantization_report(chunks)):
+            log("chunk {}: {} points, bound {:.6g}, error {:.6g}".format(i, *r), 1)
+    
+    PCVStats.record('process', time.time() - _t, n, )
+    _d = datetime.timedelta(seconds=time.time() - _t)
+    log("completed in {}.".format(_d))
     
-    if(normals):
-        ns = np.column_stack((points['nx'], points['ny'], points['nz'], ))
-    else:
-        n = len(points)
-        ns = np.column_stack((np.full(n, 0.0, dtype=np.float32, ),
-                              np.full(n, 0.0, dtype=np.float32, ),
-                              np.full(n, 1.0, dtype=np.float32, ), ))
+    return vertex_data(buffer, order, ranks, chunks, normals, vcols, quantize, )
+
+
+def vertex_data(buffer, order, ranks, chunks, normals, vcols, quantized, ):
+    vs, cs, ns = vertex_views(buffer)
+    return {'buffer': buffer, 'vertices': vs, 'colors': cs, 'normals': ns, 'order': order, 'ranks': ranks, 'chunks': chunks, 'has_normals': normals, 'has_vcols': vcols, 'quantized': quantized, }
+
+
+def load_ply_arrays(filepath, cache, progress=None, stream=None, quantize=False, ):
+    # load processed arrays from sidecar cache or process ply file and store result in cache
+    # cache is tuple from PCVSidecarCache.settings(), filepath must be absolute
+    cache_enabled, cache_directory, cache_size = cache
+    if(cache_enabled):
+        t = time.time()
+        data = PCVSidecarCache.load(filepath, cache_directory, quantize, )
+        if(data is not None):
+            PCVStats.record('cache', time.time() - t, len(data['buffer']), )
+            log("loaded from sidecar cache")
+            return data
+    data = process_ply(filepath, progress, stream, quantize=quantize, )
+    if(cache_enabled):
+        PCVSidecarCache.save(filepath, data, cache_directory, cache_size, )
+    return data
+
+
+class PCVLoadCancelled(Exception):
+    pass
+
+
+class PCVLoadJob():
+    # loads single file in separate thread, result is picked up by PCVLoader on main thread
+    def __init__(self, key, filepath, cache, quantize=False, ):
+        self.key = key
+        self.filepath = filepath
+        self.cache = cache
+        self.quantize = quantize
+        self.progress = 0.0
+        self.data = None
+        self.error = None
+        # decoded parts for preview while loading, (vertices, colors, normals, )
+        self.chunks = collections.deque()
+        self._cancel = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True, )
+    
+    def _step(self, f, ):
+        if(self._cancel.is_set()):
+            raise PCVLoadCancelled()
+        self.progress = f
+    
+    def _chunk(self, vs, cs, ns, ):
+        self.chunks.append((vs, cs, ns, ))
+    
+    def _run(self):
+        try:
+            self.data = load_ply_arrays(self.filepath, self.cache, self._step, self._chunk, self.quantize, )
+        except PCVLoadCancelled:
+            log("loading of '{}' cancelled".format(self.filepath))
+        except Exception as e:
+            self.error = e
     
-    if(vcols):
-        cs = np.column_stack((points['red'] / 255, points['green'] / 255, points['blue'] / 255, np.ones(len(points), dtype=float, ), ))
-        cs = cs.astype(np.float32)
-    else:
-        n = len(points)
-        default_color = 0.65
-        cs = np.column_stack((np.full(n, default_color, dtype=np.float32, ),
-                              np.full(n, default_color, dtype=np.float32, ),
-                              np.full(n, default_color, dtype=np.float32, ),
-                              np.ones(n, dtype=np.float32, ), ))
+    def cancel(self):
+        self._cancel.set()
+    
+    @property
+    def done(self):
+        return not self.thread.is_alive()
+
+
+class PCVLoader():
+    # jobs by cloud key
+    jobs = {}
+    # modal operator polling jobs is running
+    running = False
+    
+    @classmethod
+    def start(cls, job, operator, ):
+        cls.jobs[job.key] = job
+        job.thread.start()
+        if(bpy.app.background):
+            # no event loop to poll from
+            job.thread.join()
+            cls.update(operator)
+            return
+        if(operator is None):
+            # started outside of operator (i.e. from draw handler when evicted cloud is drawn again), poll from timer instead of modal operator
+            if(not bpy.app.timers.is_registered(cls.poll)):
+                bpy.app.timers.register(cls.poll, first_interval=0.1, )
+            return
+        if(not cls.running):
+            bpy.ops.point_cloud_visualizer.load_progress('INVOKE_DEFAULT')
+    
+    @classmethod
+    def poll(cls):
+        cls.update(None)
+        redraw_3d_views()
+        if(not len(cls.jobs)):
+            return None
+        return 0.1
+    
+    @classmethod
+    def cancel(cls, key=None, ):
+        # cancel one or all jobs and remove cache items waiting for them, threads finish on their own at next progress step
+        if(key is None):
+            ls = list(cls.jobs.keys())
+        else:
+            ls = [key, ] if key in cls.jobs else []
+        for k in ls:
+            cls.jobs.pop(k).cancel()
+            for v in PCVManager.users(k):
+                v.kill = True
+        if(len(ls)):
+            PCVManager.gc()
+    
+    @classmethod
+    def progress(cls):
+        if(not len(cls.jobs)):
+            return 1.0
+        return sum([j.progress for j in cls.jobs.values()]) / len(cls.jobs)
+    
+    @classmethod
+    def update(cls, operator, ):
+        # upload streamed parts and finish completed jobs, gpu upload must happen here on main thread
+        for k, job in cls.jobs.items():
+            if(k in PCVManager.clouds):
+                cls._stream(PCVManager.clouds[k], job, )
+        for k in [k for k, j in cls.jobs.items() if j.done]:
+            job = cls.jobs.pop(k)
+            if(k not in PCVManager.clouds):
+                continue
+            if(job.error is not None or job.data is None):
+                for v in PCVManager.users(k):
+                    v.kill = True
+                PCVManager.gc()
+                m = "Unable to load '{}': {}".format(job.filepath, job.error)
+                log(m)
+                if(operator is not None):
+                    operator.report({'ERROR'}, m)
+                continue
+            PCVManager.clouds[k].load(job.data)
+            for v in PCVManager.users(k):
+                cls._finish(v)
+    
+    @classmethod
+    def _stream(cls, c, job, ):
+        while(len(job.chunks)):
+            vs, cs, ns = job.chunks.popleft()
+            c.has_normals = ns is not None
+            c.has_vcols = cs is not None
+            if(bpy.app.background):
+                # nothing is drawn without ui, only final data are used
+                continue
+            c.stream.append(vertex_batch(vs, cs, ns, ))
+    
+    @classmethod
+    def _finish(cls, d, ):
+        # set up cache item when its point data are ready, object reference is refreshed by undo/redo handlers meanwhile
+        o = d.object
+        try:
+            ok = (o is not None and o.point_cloud_visualizer.uuid == d.uuid)
+        except ReferenceError:
+            ok = False
+        if(not ok):
+            # object was removed or loaded another file meanwhile
+            d.kill = True
+            PCVManager.gc()
+            return
+        pcv = o.point_cloud_visualizer
+        
+        pcv.has_normals = d.has_normals
+        if(not pcv.has_normals):
+            pcv.light_enabled = False
+        pcv.has_vcols = d.has_vcols
+        
+        dp = pcv.display_percent
+        l = int((d.length / 100) * dp)
+        if(dp >= 99):
+            l = d.length
+        d.display_percent = l
+        d.current_display_percent = l
+        d.counts = d.cloud.display_counts(l)
+        
+        d.uniforms = None
+        d.object = o
+        PCVManager.objects[o.as_pointer()] = d
+
+
+def load_ply_to_cache(operator, context, ):
+    return load_object_to_cache(operator, context.object, )
+
+
+def load_object_to_cache(operator, o, ):
+    # start loading in background, cache item is created right away, it is drawn when loading finishes,
+    # if the same file is already loaded or loading for another object, its data are used
+    pcv = o.point_cloud_visualizer
+    filepath = os.path.realpath(bpy.path.abspath(pcv.filepath))
+    
+    if(not os.path.isfile(filepath)):
+        m = "did you point me to an imaginary file? ('{}')".format(filepath)
+        if(operator is not None):
+            operator.report({'ERROR'}, m)
+            return False
+        raise OSError(m)
+    
+    PCVManager.init()
     
     u = str(uuid.uuid1())
-    o = context.object
     
     pcv.uuid = u
     
-    d = PCVManager.new()
-    d['uuid'] = u
-    d['stats'] = len(vs)
-    d['vertices'] = vs
-    d['colors'] = cs
-    d['normals'] = ns
-    
-    d['length'] = len(vs)
-    dp = pcv.display_percent
-    l = int((len(vs) / 100) * dp)
-    if(dp >= 99):
-        l = len(vs)
-    d['display_percent'] = l
-    d['current_display_percent'] = l
-    shader = GPUShader(PCVShaders.vertex_shader, PCVShaders.fragment_shader)
-    batch = batch_for_shader(shader, 'POINTS', {"position": vs[:l], "color": cs[:l], "normal": ns[:l], })
-    
-    d['shader'] = shader
-    d['batch'] = batch
-    d['ready'] = True
-    d['object'] = o
-    d['name'] = o.name
-    
+    c = PCVManager.cloud(cloud_key(filepath, pcv.quantize_positions, ))
+    d = PCVManager.new(c)
+    d.uuid = u
+    d.object = o
+    d.name = o.name
     PCVManager.add(d)
     
-    _d = datetime.timedelta(seconds=time.time() - _t)
-    log("completed in {}.".format(_d))
-    
-    log("-" * 50)
-    __d = datetime.timedelta(seconds=time.time() - __t)
-    log("load and process completed in {}.".format(__d))
-    log("-" * 50)
+    if(c.ready):
+        PCVLoader._finish(d)
+    elif(not c.loading):
+        PCVManager.rehydrate(c, operator, )
     
-    return True
+    return u in PCVManager.cache
+
 
+def redraw_3d_views():
+    for w in bpy.context.window_manager.windows:
+        for a in w.screen.areas:
+            if(a.type == 'VIEW_3D'):
+                a.tag_redraw()
 
-def save_render(operator, scene, image, render_suffix, render_zeros, ):
+
+def render_filepath(operator, scene, render_suffix, render_zeros, ):
+    # output png path for current frame from render output path, None if output path is not set
     f = False
     n = render_suffix
-    rs = bpy.context.scene.render
+    rs = scene.render
     op = rs.filepath
     if(len(op) > 0):
         if(not op.endswith(os.path.sep)):
             f = True
             op, n = os.path.split(op)
     else:
-        log("error: output path is not set".format(e))
+        log("error: output path is not set")
         operator.report({'ERROR'}, "Output path is not set.")
-        return
+        return None
     
     if(f):
         n = "{}_{}".format(n, render_suffix)
     
     fnm = "{}_{:0{z}d}.png".format(n, scene.frame_current, z=render_zeros)
-    p = os.path.join(os.path.realpath(bpy.path.abspath(op)), fnm)
-    
-    s = rs.image_settings
-    ff = s.file_format
-    cm = s.color_mode
-    cd = s.color_depth
-    
-    vs = scene.view_settings
-    vsvt = vs.view_transform
-    vsl = vs.look
-    vs.view_transform = 'Default'
-    vs.look = 'None'
-    
-    s.file_format = 'PNG'
-    s.color_mode = 'RGBA'
-    s.color_depth = '8'
-    
+    return os.path.join(os.path.realpath(bpy.path.abspath(op)), fnm)
+
+
+def read_pixels(width, height, ):
+    # rgba pixels of bound framebuffer as uint8 array (height, width, 4, ), bottom row first as in opengl
+    # each GL_INT item holds one pixel, so if buffer does not support buffer protocol (older blender), only width * height values are converted
+    buffer = bgl.Buffer(bgl.GL_INT, width * height)
+    bgl.glReadBuffer(bgl.GL_BACK)
+    bgl.glReadPixels(0, 0, width, height, bgl.GL_RGBA, bgl.GL_UNSIGNED_BYTE, buffer)
+    try:
+        a = np.frombuffer(buffer, dtype=np.uint8, ).copy()
+    except (TypeError, ValueError, ):
+        a = None
+    if(a is None or len(a) != width * height * 4):
+        a = np.array(buffer.to_list(), dtype=np.int32, ).view(np.uint8)
+    return a.reshape(height, width, 4, )
+
+
+def render_loaded(operator, v, ):
+    # True if point data of cache item are in memory, cloud evicted to fit memory budget is loaded again, in background mode
+    # loading finishes right away, otherwise render has to be started again when it is loaded
+    if(v.ready):
+        return True
+    if(v.evicted and not v.loading):
+        PCVManager.rehydrate(v.cloud, operator, )
+    if(v.ready):
+        return True
+    operator.report({'WARNING'}, "Point cloud was released from memory to fit memory budget and is being loaded again, render when it is loaded.")
+    return False
+
+
+def pixels_to_image(name, pixels, ):
+    # copy rgba uint8 array (height, width, 4, ) to blender image, created if missing, blender images are also bottom row first
+    h, w, _ = pixels.shape
+    if(name not in bpy.data.images):
+        bpy.data.images.new(name, w, h)
+    image = bpy.data.images[name]
+    image.scale(w, h)
+    image.pixels.foreach_set((pixels.astype(np.float32) / 255).ravel())
+    return image
+
+
+def save_pixels(operator, scene, pixels, render_suffix, render_zeros, ):
+    # png is written straight from pixels, color management does not apply to raw output, returns False on error
+    p = render_filepath(operator, scene, render_suffix, render_zeros, )
+    if(p is None):
+        return False
     try:
-        image.save_render(p)
+        point_cloud_rasterizer.write_png(p, pixels, )
         log("image '{}' saved".format(p))
     except Exception as e:
-        s.file_format = ff
-        s.color_mode = cm
-        s.color_depth = cd
-        
         log("error: {}".format(e))
         operator.report({'ERROR'}, "Unable to save render image, see console for details.")
-        return
-    
-    s.file_format = ff
-    s.color_mode = cm
-    s.color_depth = cd
-    vs.view_transform = vsvt
-    vs.look = vsl
+        return False
+    return True
+
+
+class PCVRenderSession():
+    # renders cache item from scene camera, offscreen, shader and batch are kept for rendering of frame sequence,
+    # points are sorted by depth and uploaded again only when object to camera depth changes,
+    # with cpu backend (always in background mode, there might be no opengl) points are rasterized by numpy without sorting
+    def __init__(self, cloud, scene, cpu=False, ):
+        render = scene.render
+        scale = render.resolution_percentage / 100
+        self.width = int(render.resolution_x * scale)
+        self.height = int(render.resolution_y * scale)
+        self.cloud = cloud
+        
+        o = cloud.object
+        pcv = o.point_cloud_visualizer
+        vs = cloud.vertices
+        dp = pcv.render_display_percent
+        l = int((len(vs) / 100) * dp)
+        if(dp >= 99):
+            l = len(vs)
+        # the same points as in viewport at the same percentage
+        self.index = display_index(cloud.chunks, cloud.ranks, l, )
+        if(cloud.quantized):
+            vs = dequantize_positions(vs, cloud.chunks, )
+        self.vertices = vs[self.index]
+        
+        self.cpu = (cpu or pcv.render_backend == 'CPU' or bpy.app.background)
+        self.shader = None
+        self.offscreen = None
+        if(self.cpu):
+            cs = cloud.colors
+            ns = cloud.normals
+            self.colors = None if cs is None else cs[self.index]
+            self.normals = None if ns is None else ns[self.index]
+        else:
+            self.shader = PCVShaders.get(cloud.normals is not None, cloud.colors is not None, False, pcv.light_enabled, pcv.show_normals, )
+            self.offscreen = GPUOffScreen(self.width, self.height)
+        self.batch = None
+        # depth row of object to camera matrix points were sorted with
+        self.depth = None
+        self.frames = 0
+        self.sorts = 0
+        self.time = 0.0
+    
+    def _sort(self, matrix, ):
+        # sort by depth, far to near, display index and depth order are combined, so arrays are gathered once
+        order = depth_order(self.vertices, matrix, )
+        index = self.index[order]
+        cs = self.cloud.colors
+        ns = self.cloud.normals
+        self.batch = vertex_batch(self.vertices[order], None if cs is None else cs[index], None if ns is None else ns[index], )
+        self.sorts += 1
+    
+    def render(self, scene, ):
+        # rgba uint8 pixels (height, width, 4, ) of current frame, bottom row first
+        t = time.perf_counter()
+        o = self.cloud.object
+        pcv = o.point_cloud_visualizer
+        cam = scene.camera
+        render = scene.render
+        
+        if(self.cpu):
+            pixels = self._rasterize(scene)
+            t = time.perf_counter() - t
+            self.frames += 1
+            self.time += t
+            PCVStats.record('render', t, len(self.index), )
+            return pixels
+        
+        # camera or object moving sideways does not change order, only depth row is compared
+        m = np.array(cam.matrix_world.normalized().inverted() @ o.matrix_world, dtype=np.float64, )
+        if(self.depth is None or not np.array_equal(self.depth, m[2])):
+            self._sort(m)
+            self.depth = m[2]
+        
+        self.offscreen.bind()
+        try:
+            bgl.glEnable(bgl.GL_PROGRAM_POINT_SIZE)
+            gpu.matrix.load_matrix(Matrix.Identity(4))
+            gpu.matrix.load_projection_matrix(Matrix.Identity(4))
+            
+            bgl.glClear(bgl.GL_COLOR_BUFFER_BIT)
+            
+            shader = self.shader
+            shader.bind()
+            # uniforms are set here directly, viewport has to send its own again
+            PCVShaders.owners.pop(id(shader), None)
+            
+            view_matrix = cam.matrix_world.inverted()
+            camera_matrix = cam.calc_matrix_camera(bpy.context.depsgraph, x=render.resolution_x, y=render.resolution_y, scale_x=render.pixel_aspect_x, scale_y=render.pixel_aspect_y, )
+            perspective_matrix = camera_matrix @ view_matrix
+            
+            shader.uniform_float("perspective_matrix", perspective_matrix)
+            shader.uniform_float("object_matrix", o.matrix_world)
+            shader.uniform_float("point_size", pcv.render_point_size)
+            shader.uniform_float("alpha_radius", pcv.alpha_radius)
+            if(self.cloud.normals is not None and pcv.light_enabled and not pcv.show_normals):
+                light_uniforms(shader, pcv, o, )
+            
+            self.batch.draw(shader)
+            
+            pixels = read_pixels(self.width, self.height, )
+        finally:
+            self.offscreen.unbind()
+        
+        t = time.perf_counter() - t
+        self.frames += 1
+        self.time += t
+        PCVStats.record('render', t, len(self.index), )
+        return pixels
+    
+    def frame(self, scene, ):
+        # rasterizer arguments of current frame as plain values, so they can be passed to worker processes as json
+        o = self.cloud.object
+        pcv = o.point_cloud_visualizer
+        cam = scene.camera
+        render = scene.render
+        camera_matrix = cam.calc_matrix_camera(bpy.context.depsgraph, x=render.resolution_x, y=render.resolution_y, scale_x=render.pixel_aspect_x, scale_y=render.pixel_aspect_y, )
+        matrix = np.array(camera_matrix @ cam.matrix_world.inverted() @ o.matrix_world, dtype=np.float64, )
+        light = None
+        if(self.normals is not None and pcv.light_enabled and not pcv.show_normals):
+            light = {k: [float(f) for f in v] for k, v in light_vectors(pcv, o.matrix_world, ).items()}
+        return {'matrix': [float(f) for f in matrix.ravel()],
+                'point_size': float(pcv.render_point_size),
+                'alpha_radius': float(pcv.alpha_radius),
+                'light': light,
+                'show_normals': bool(self.normals is not None and pcv.light_enabled and pcv.show_normals), }
+    
+    def _rasterize(self, scene, ):
+        f = self.frame(scene)
+        return point_cloud_rasterizer.rasterize(self.vertices, self.colors, self.normals, np.array(f['matrix']).reshape(4, 4, ), self.width, self.height,
+                                                f['point_size'], f['alpha_radius'], f['light'], f['show_normals'], )
+    
+    def render_processes(self, frames, processes, ):
+        # render frames (list of dicts from frame() with 'filepath' of output png) in separate processes with cpu rasterizer,
+        # points are saved once to temporary .npy files, which all workers memory map, frames are interleaved between workers,
+        # so each worker gets frames from whole range, returns list of error messages of failed workers
+        t = time.perf_counter()
+        d = tempfile.mkdtemp(prefix='pcv_', )
+        errors = []
+        try:
+            arrays = {}
+            for k, a in (('vertices', self.vertices, ), ('colors', self.colors, ), ('normals', self.normals, ), ):
+                arrays[k] = None
+                if(a is not None):
+                    arrays[k] = os.path.join(d, "{}.npy".format(k))
+                    np.save(arrays[k], np.ascontiguousarray(a), )
+            # each worker is single threaded, numpy must not start threads of its own in all of them
+            env = dict(os.environ)
+            for k in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', ):
+                env[k] = '1'
+            python = getattr(bpy.app, 'binary_path_python', sys.executable, )
+            workers = []
+            for i in range(processes):
+                job = {'arrays': arrays, 'width': self.width, 'height': self.height, 'frames': frames[i::processes], }
+                p = os.path.join(d, "job_{}.json".format(i))
+                with open(p, 'w') as f:
+                    json.dump(job, f, )
+                workers.append(subprocess.Popen([python, point_cloud_rasterizer.__file__, p, ], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env, ))
+            for w in workers:
+                _, e = w.communicate()
+                if(w.returncode != 0):
+                    errors.append(e.decode('utf-8', 'replace', ).strip())
+        finally:
+            shutil.rmtree(d, ignore_errors=True, )
+        t = time.perf_counter() - t
+        self.frames += len(frames)
+        self.time += t
+        PCVStats.record('render', t, len(self.index) * len(frames), )
+        return errors
+    
+    def throughput(self):
+        # (frames per second, points per second, ) of rendered frames
+        if(self.time == 0.0):
+            return 0.0, 0.0
+        return self.frames / self.time, self.frames * len(self.index) / self.time
+    
+    def free(self):
+        self.batch = None
+        if(self.offscreen is not None):
+            self.offscreen.free()
+            self.offscreen = None
+
+
+def cloud_key(filepath, quantize, ):
+    # identity of loaded point data, the same file with the same size and modification time is loaded only once
+    st = os.stat(filepath)
+    return (filepath, st.st_size, st.st_mtime_ns, bool(quantize), )
+
+
+class PCVCloud():
+    # point data of one file shared by all cache items showing it, arrays are set when loading finishes
+    __slots__ = ('key', 'filepath', 'quantize', 'buffer', 'vertices', 'colors', 'normals', 'ranks', 'chunks', 'quantized', 'has_normals', 'has_vcols', 'length', 'batches', 'stream', 'ready', 'loading', 'evicted', 'used', )
+    
+    def __init__(self, key, ):
+        self.key = key
+        self.filepath = key[0]
+        self.quantize = key[3]
+        self.buffer = None
+        self.vertices = None
+        self.colors = None
+        self.normals = None
+        self.ranks = None
+        self.chunks = None
+        self.quantized = False
+        self.has_normals = False
+        self.has_vcols = False
+        self.length = 0
+        self.batches = None
+        self.stream = []
+        self.ready = False
+        self.loading = False
+        # arrays were released to fit memory budget and are loaded again when drawn
+        self.evicted = False
+        # time of last draw with any points, for lru eviction
+        self.used = time.time()
+    
+    def items(self):
+        return [(k, getattr(self, k)) for k in self.__slots__]
+    
+    def load(self, data, ):
+        vs = data['vertices']
+        self.buffer = data['buffer']
+        self.vertices = vs
+        self.colors = data['colors']
+        self.normals = data['normals']
+        self.ranks = data['ranks']
+        self.chunks = data['chunks']
+        self.quantized = data['quantized']
+        self.has_normals = data['normals'] is not None
+        self.has_vcols = data['colors'] is not None
+        self.length = len(vs)
+        # uploaded by draw handler when first drawn in view, in background mode there is no gpu to upload to
+        self.batches = None
+        self.stream = []
+        self.loading = False
+        self.evicted = False
+        self.ready = True
+        self.used = time.time()
+    
+    def display_counts(self, count, ):
+        # displayed points in each chunk when count points are displayed
+        return chunk_counts(self.chunks, self.ranks, count, )
+    
+    def cpu_bytes(self):
+        # arrays in memory, memory maps of sidecar cache files are not counted, system can drop their pages any time
+        return sum([a.nbytes for a in (self.buffer, self.ranks, ) if a is not None and not isinstance(a, np.memmap)])
+    
+    def gpu_bytes(self):
+        if(self.batches is None):
+            return 0
+        return self.batches.nbytes()
+    
+    def unload(self):
+        # release everything loaded, chunks are kept for visibility test and arrays are loaded again when drawn
+        self.buffer = None
+        self.vertices = None
+        self.colors = None
+        self.normals = None
+        self.ranks = None
+        self.batches = None
+        self.ready = False
+        self.evicted = True
+
+
+def _cloud_attribute(name, ):
+    return property(lambda self: getattr(self.cloud, name), )
+
+
+class PCVCacheItem():
+    # one object showing point cloud, its point data are shared with other objects showing the same file
+    __slots__ = ('uuid', 'name', 'object', 'cloud', 'display_percent', 'current_display_percent', 'counts', 'uniforms', 'draw', 'kill', )
+    
+    def __init__(self, uuid=None, cloud=None, ):
+        self.uuid = uuid
+        self.name = None
+        self.object = None
+        self.cloud = cloud
+        self.display_percent = None
+        self.current_display_percent = None
+        # displayed points in each chunk
+        self.counts = None
+        # cached uniform values, None when transform or properties changed
+        self.uniforms = None
+        self.draw = False
+        self.kill = False
+    
+    # read only access to shared point data
+    buffer = _cloud_attribute('buffer')
+    vertices = _cloud_attribute('vertices')
+    colors = _cloud_attribute('colors')
+    normals = _cloud_attribute('normals')
+    ranks = _cloud_attribute('ranks')
+    chunks = _cloud_attribute('chunks')
+    quantized = _cloud_attribute('quantized')
+    has_normals = _cloud_attribute('has_normals')
+    has_vcols = _cloud_attribute('has_vcols')
+    length = _cloud_attribute('length')
+    stats = _cloud_attribute('length')
+    batches = _cloud_attribute('batches')
+    stream = _cloud_attribute('stream')
+    ready = _cloud_attribute('ready')
+    loading = _cloud_attribute('loading')
+    evicted = _cloud_attribute('evicted')
+    
+    def items(self):
+        r = [(k, getattr(self, k)) for k in self.__slots__ if k != 'cloud']
+        return r + [("cloud.{}".format(k), v) for k, v in self.cloud.items()]
 
 
 class PCVManager():
+    # cache items by uuid and by object pointer, shared point data by cloud key
     cache = {}
+    objects = {}
+    clouds = {}
+    objects_count = 0
+    # points drawn in last frame from ready clouds, draw handler timing is in PCVStats
+    points_drawn = 0
+    # last view matrix and time it changed by region, full budget is used after views did not change for settle seconds
+    views = {}
+    settle = 0.25
+    refine_pending = False
+    # seconds since last draw before cloud can be evicted to fit memory budgets
+    idle = 2.0
+    # dead object reference was found while drawing, i.e. object removed and another added in the same update, validated after drawing
+    invalid = False
     handle = None
     initialized = False
     
     @classmethod
-    def render(cls, uuid, ):
+    def render(cls, uuid, counts=None, ):
         bgl.glEnable(bgl.GL_PROGRAM_POINT_SIZE)
         
         ci = PCVManager.cache[uuid]
         
-        shader = ci['shader']
-        batch = ci['batch']
-        
-        if(ci['current_display_percent'] != ci['display_percent']):
-            l = ci['display_percent']
-            ci['current_display_percent'] = l
-            vs = ci['vertices']
-            cs = ci['colors']
-            ns = ci['normals']
-            batch = batch_for_shader(shader, 'POINTS', {"position": vs[:l], "color": cs[:l], "normal": ns[:l], })
-            ci['batch'] = batch
-        
-        o = ci['object']
+        o = ci.object
         try:
             pcv = o.point_cloud_visualizer
         except ReferenceError:
+            # object references are refreshed in undo/redo handlers, or after this redraw if object was removed otherwise
             log("PCVManager.render: ReferenceError (possibly after undo/redo?)")
-            # blender on undo/redo swaps whole scene to different one stored in memory and therefore stored object references are no longer valid
-            # so find object with the same name, not the best solution, but lets see how it goes..
-            o = bpy.data.objects[ci['name']]
-            # update stored reference
-            ci['object'] = o
-            pcv = o.point_cloud_visualizer
+            cls.invalid = True
+            return
         
+        # streamed parts are not quantized
+        quantized = ci.ready and ci.quantized
+        shader = PCVShaders.get(ci.has_normals, ci.has_vcols, quantized, pcv.light_enabled, pcv.show_normals, )
         shader.bind()
+        PCVStats.count('shader_binds')
         pm = bpy.context.region_data.perspective_matrix
-        shader.uniform_float("perspective_matrix", pm)
-        shader.uniform_float("object_matrix", o.matrix_world)
-        shader.uniform_float("point_size", pcv.point_size)
-        shader.uniform_float("alpha_radius", pcv.alpha_radius)
-        
-        if(pcv.light_enabled and pcv.has_normals):
-            cm = Matrix(((-1.0, 0.0, 0.0, 0.0, ), (0.0, -0.0, 1.0, 0.0, ), (0.0, -1.0, -0.0, 0.0, ), (0.0, 0.0, 0.0, 1.0, ), ))
-            _, obrot, _ = o.matrix_world.decompose()
-            mr = obrot.to_matrix().to_4x4()
-            mr.invert()
-            direction = cm @ pcv.light_direction
-            direction = mr @ direction
-            shader.uniform_float("light_direction", direction)
-            
-            # def get_space3dview():
-            #     for a in bpy.context.screen.areas:
-            #         if(a.type == "VIEW_3D"):
-            #             return a.spaces[0]
-            #     return None
-            #
-            # s3dv = get_space3dview()
-            # region3d = s3dv.region_3d
-            # eye = region3d.view_matrix[2][:3]
-            #
-            # # shader.uniform_float("light_direction", Vector(eye) * -1)
-            # shader.uniform_float("light_direction", Vector(eye))
-            
-            inverted_direction = direction.copy()
-            inverted_direction.negate()
-            
-            c = pcv.light_intensity
-            shader.uniform_float("light_intensity", (c, c, c, ))
-            shader.uniform_float("shadow_direction", inverted_direction)
-            c = pcv.shadow_intensity
-            shader.uniform_float("shadow_intensity", (c, c, c, ))
-            shader.uniform_float("show_normals", float(pcv.show_normals))
-            shader.uniform_float("show_illumination", float(pcv.light_enabled))
+        if(quantized):
+            # chunk matrices are composed in double precision
+            m = np.array(pm, dtype=np.float64, ) @ np.array(o.matrix_world, dtype=np.float64, )
         else:
-            z = (0, 0, 0)
-            shader.uniform_float("light_direction", z)
-            shader.uniform_float("light_intensity", z)
-            shader.uniform_float("shadow_direction", z)
-            shader.uniform_float("shadow_intensity", z)
-            shader.uniform_float("show_normals", float(False))
-            shader.uniform_float("show_illumination", float(False))
-        
-        batch.draw(shader)
+            shader.uniform_float("perspective_matrix", pm)
+        # derived values are cached until transform or properties change and are sent only if shader has values of another cloud
+        if(ci.uniforms is None):
+            ci.uniforms = object_uniforms(pcv, o, pcv.point_size, ci.has_normals and pcv.light_enabled and not pcv.show_normals, quantized, )
+        if(PCVShaders.owners.get(id(shader)) is not ci.uniforms):
+            for k, v in ci.uniforms.items():
+                shader.uniform_float(k, v)
+            PCVShaders.owners[id(shader)] = ci.uniforms
+        
+        if(ci.ready):
+            ci.batches.draw(shader, quantized, counts, ci.counts, m if quantized else None, )
+        else:
+            # still loading, draw parts streamed so far
+            for b in ci.stream:
+                b.draw(shader)
     
     @classmethod
     def handler(cls):
-        bobjects = bpy.data.objects
-        
-        run_gc = False
-        for k, v in cls.cache.items():
-            if(not bobjects.get(v['name'])):
-                v['kill'] = True
-                run_gc = True
-            if(v['ready'] and v['draw'] and not v['kill']):
-                cls.render(v['uuid'])
-        if(run_gc):
+        # removed objects are found by depsgraph and undo handlers, not here on every redraw
+        t = time.perf_counter()
+        for v in cls.cache.values():
+            if(v.evicted and not v.loading and v.draw and not v.kill and cls.in_view(v, bpy.context.region_data.perspective_matrix, )):
+                cls.rehydrate(v.cloud)
+        items = [v for v in cls.cache.values() if((v.ready or len(v.stream)) and v.draw and not v.kill)]
+        counts = cls.distribute(items, bpy.context.region_data, )
+        now = time.time()
+        for v in items:
+            c = counts.get(v.uuid)
+            if(v.ready and v.batches is None):
+                # not uploaded yet or evicted from gpu memory and out of view, uploaded by distribute only when in view
+                continue
+            if(c is not None and c.any()):
+                v.cloud.used = now
+            cls.render(v.uuid, c, )
+        if(cls.invalid):
+            cls.validate()
+        cls.evict(now)
+        PCVStats.record('draw', time.perf_counter() - t, cls.points_drawn, )
+    
+    @classmethod
+    def distribute(cls, items, region_data, ):
+        # counts of points drawn from chunks of each ready item by uuid, chunks outside of view get nothing,
+        # the rest share frame point budget by their projected area, so near and large chunks get more points
+        pm = region_data.perspective_matrix
+        uuids = []
+        caps = []
+        weights = []
+        for v in items:
+            if(not v.ready):
+                continue
+            try:
+                m = pm @ v.object.matrix_world
+            except ReferenceError:
+                cls.invalid = True
+                continue
+            if(v.batches is None):
+                # not uploaded yet or evicted from gpu memory, uploaded when in view
+                if(not cls.in_view(v, pm, )):
+                    continue
+                v.cloud.batches = PCVBatches(v.vertices, v.colors, v.normals, v.chunks, )
+            if(v.current_display_percent != v.display_percent):
+                # no upload, only draw ranges change
+                v.current_display_percent = v.display_percent
+                v.counts = v.cloud.display_counts(v.display_percent)
+            c, w = v.batches.project(m, v.counts, )
+            uuids.append(v.uuid)
+            caps.append(c)
+            weights.append(w)
+        cls.points_drawn = 0
+        if(not len(uuids)):
+            return {}
+        counts = budget_counts(np.concatenate(caps), np.concatenate(weights), cls.frame_budget(region_data), )
+        cls.points_drawn = int(counts.sum())
+        return dict(zip(uuids, np.split(counts, np.cumsum([len(c) for c in caps])[:-1], ), ))
+    
+    @classmethod
+    def frame_budget(cls, region_data, ):
+        # point budget for this redraw, lowered while view is changing, when view stops, redraw with full budget is scheduled
+        p = preferences()
+        budget, factor = (10 ** 7, 0.25, ) if p is None else (p.point_budget, p.navigation_budget, )
+        if(budget == 0):
+            return 0
+        k = region_data.as_pointer()
+        pm = region_data.perspective_matrix
+        now = time.time()
+        last = cls.views.get(k)
+        if(last is None or last[0] != pm):
+            cls.views[k] = (pm.copy(), now, )
+        elif(now - last[1] >= cls.settle):
+            return budget
+        if(not cls.refine_pending):
+            cls.refine_pending = True
+            bpy.app.timers.register(cls.refine, first_interval=cls.settle, )
+        return max(int(budget * factor), 1)
+    
+    @classmethod
+    def refine(cls):
+        # timer, wait until all views stopped changing, then redraw them with full budget
+        wait = max([t for _, t in cls.views.values()] + [0.0, ]) + cls.settle - time.time()
+        if(wait > 0.0):
+            return wait
+        cls.refine_pending = False
+        redraw_3d_views()
+        return None
+    
+    @classmethod
+    def memory(cls):
+        # (cpu bytes, gpu bytes, ) used by all cached clouds, shared data counted once
+        return sum([c.cpu_bytes() for c in cls.clouds.values()]), sum([c.gpu_bytes() for c in cls.clouds.values()])
+    
+    @classmethod
+    def evict(cls, now, ):
+        # free least recently drawn clouds not drawn for some time until memory fits budgets from preferences,
+        # over gpu budget only batches are freed and uploaded again when drawn, over cpu budget arrays are released too
+        p = preferences()
+        if(p is None):
+            return
+        cpu_limit = p.cpu_memory * 2 ** 20
+        gpu_limit = p.gpu_memory * 2 ** 20
+        if(cpu_limit == 0 and gpu_limit == 0):
+            return
+        cpu, gpu = cls.memory()
+        if((cpu_limit == 0 or cpu <= cpu_limit) and (gpu_limit == 0 or gpu <= gpu_limit)):
+            return
+        # clouds turned off for all their objects go first
+        drawn = set([v.cloud.key for v in cls.cache.values() if v.draw])
+        idle = sorted([c for c in cls.clouds.values() if c.ready and now - c.used > cls.idle], key=lambda c: (c.key in drawn, c.used, ), )
+        for c in idle:
+            if(gpu_limit != 0 and gpu > gpu_limit and c.batches is not None):
+                gpu -= c.gpu_bytes()
+                c.batches = None
+                log("evicted '{}' from gpu memory".format(c.filepath))
+            if(cpu_limit != 0 and cpu > cpu_limit and c.cpu_bytes() > 0):
+                cpu -= c.cpu_bytes()
+                gpu -= c.gpu_bytes()
+                c.unload()
+                log("evicted '{}' from memory".format(c.filepath))
+    
+    @classmethod
+    def in_view(cls, v, pm, ):
+        # any chunk of cloud is in view frustum, chunks are kept when cloud is evicted
+        try:
+            m = pm @ v.object.matrix_world
+        except ReferenceError:
+            return False
+        return bool(chunk_visibility(chunk_clip(chunk_corners(v.chunks), m, )).any())
+    
+    @classmethod
+    def rehydrate(cls, c, operator=None, ):
+        # load cloud data in background, from sidecar cache if it is there, all items using it are set up when it finishes
+        if(not os.path.isfile(c.filepath)):
+            log("unable to load '{}', file does not exist".format(c.filepath))
+            for v in cls.users(c.key):
+                v.kill = True
             cls.gc()
+            return
+        c.loading = True
+        PCVLoader.start(PCVLoadJob(c.key, c.filepath, PCVSidecarCache.settings(), c.quantize, ), operator, )
+    
+    @classmethod
+    def validate(cls):
+        # refresh object references and kill items of removed objects, blender on undo/redo swaps whole scene to different one stored in memory
+        # and therefore stored object references are no longer valid, then object with the same uuid is used, object might have been renamed
+        bobjects = bpy.data.objects
+        owners = {}
+        for o in bobjects:
+            u = o.point_cloud_visualizer.uuid
+            # duplicated object has the same uuid, the first one keeps drawing
+            if(u != "" and u not in owners):
+                owners[u] = o
+        cls.objects = {}
+        for v in cls.cache.values():
+            o = owners.get(v.uuid)
+            if(o is None):
+                v.kill = True
+                continue
+            v.object = o
+            v.name = o.name
+            v.uniforms = None
+            cls.objects[o.as_pointer()] = v
+        cls.objects_count = len(bobjects)
+        cls.invalid = False
+        cls.gc()
     
     @classmethod
     def gc(cls):
         l = []
         for k, v in cls.cache.items():
-            if(v['kill']):
+            if(v.kill):
                 l.append(k)
         for i in l:
-            del cls.cache[i]
+            v = cls.cache.pop(i)
+            try:
+                if(v.object is not None and cls.objects.get(v.object.as_pointer()) is v):
+                    del cls.objects[v.object.as_pointer()]
+            except ReferenceError:
+                pass
+        # shared data without items are released
+        used = set([v.cloud.key for v in cls.cache.values()])
+        for k in [k for k in cls.clouds.keys() if k not in used]:
+            del cls.clouds[k]
+            if(k in PCVLoader.jobs):
+                PCVLoader.jobs.pop(k).cancel()
     
     @classmethod
     def init(cls):
@@ -704,6 +2364,11 @@ class PCVManager():
             return
         cls.handle = bpy.types.SpaceView3D.draw_handler_add(cls.handler, (), 'WINDOW', 'POST_VIEW')
         bpy.app.handlers.load_pre.append(watcher)
+        bpy.app.handlers.depsgraph_update_post.append(depsgraph_watcher)
+        bpy.app.handlers.frame_change_post.append(frame_watcher)
+        bpy.app.handlers.undo_post.append(undo_watcher)
+        bpy.app.handlers.redo_post.append(undo_watcher)
+        cls.objects_count = len(bpy.data.objects)
         cls.initialized = True
     
     @classmethod
@@ -711,33 +2376,79 @@ class PCVManager():
         if(not cls.initialized):
             return
         for k, v in cls.cache.items():
-            v['kill'] = True
+            v.kill = True
         cls.gc()
+        cls.objects = {}
         
         bpy.types.SpaceView3D.draw_handler_remove(cls.handle, 'WINDOW')
         cls.handle = None
+        if(cls.refine_pending):
+            bpy.app.timers.unregister(cls.refine)
+            cls.refine_pending = False
+        cls.views = {}
         bpy.app.handlers.load_pre.remove(watcher)
+        bpy.app.handlers.depsgraph_update_post.remove(depsgraph_watcher)
+        bpy.app.handlers.frame_change_post.remove(frame_watcher)
+        bpy.app.handlers.undo_post.remove(undo_watcher)
+        bpy.app.handlers.redo_post.remove(undo_watcher)
         cls.initialized = False
     
     @classmethod
     def add(cls, data, ):
-        cls.cache[data['uuid']] = data
+        cls.cache[data.uuid] = data
+        if(data.object is not None):
+            cls.objects[data.object.as_pointer()] = data
     
     @classmethod
-    def new(cls):
-        return {'uuid': None,
-                'vertices': None,
-                'colors': None,
-                'display_percent': None,
-                'current_display_percent': None,
-                'shader': False,
-                'batch': False,
-                'ready': False,
-                'draw': False,
-                'kill': False,
-                'stats': None,
-                'name': None,
-                'object': None, }
+    def new(cls, cloud, ):
+        return PCVCacheItem(cloud=cloud, )
+    
+    @classmethod
+    def cloud(cls, key, ):
+        # shared data for cloud key, new empty if file is not loaded yet
+        if(key not in cls.clouds):
+            cls.clouds[key] = PCVCloud(key)
+        return cls.clouds[key]
+    
+    @classmethod
+    def users(cls, key, ):
+        # cache items using shared data with key
+        return [v for v in cls.cache.values() if v.cloud.key == key]
+
+
+class PCV_OT_load_progress(Operator):
+    bl_idname = "point_cloud_visualizer.load_progress"
+    bl_label = "Loading Point Clouds"
+    bl_description = "Wait for point clouds loading in background, Esc to cancel"
+    
+    _timer = None
+    
+    def invoke(self, context, event):
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.1, window=context.window, )
+        wm.progress_begin(0, 100)
+        wm.modal_handler_add(self)
+        PCVLoader.running = True
+        return {'RUNNING_MODAL'}
+    
+    def modal(self, context, event):
+        if(event.type not in ('TIMER', 'ESC', )):
+            return {'PASS_THROUGH'}
+        if(event.type == 'ESC'):
+            PCVLoader.cancel()
+            self.report({'WARNING'}, "Point cloud loading cancelled.")
+        PCVLoader.update(self)
+        
+        wm = context.window_manager
+        wm.progress_update(int(PCVLoader.progress() * 100))
+        redraw_3d_views()
+        
+        if(not len(PCVLoader.jobs)):
+            wm.event_timer_remove(self._timer)
+            wm.progress_end()
+            PCVLoader.running = False
+            return {'FINISHED'}
+        return {'RUNNING_MODAL'}
 
 
 class PCV_OT_init(Operator):
@@ -777,14 +2488,9 @@ class PCV_OT_draw(Operator):
     @classmethod
     def poll(cls, context):
         pcv = context.object.point_cloud_visualizer
-        ok = False
-        cached = False
-        for k, v in PCVManager.cache.items():
-            if(v['uuid'] == pcv.uuid):
-                if(v['ready']):
-                    cached = True
-                    if(not v['draw']):
-                        ok = True
+        v = PCVManager.cache.get(pcv.uuid)
+        cached = (v is not None and v.ready)
+        ok = (cached and not v.draw)
         if(not ok and pcv.filepath != "" and pcv.uuid != "" and not cached):
             ok = True
         return ok
@@ -800,8 +2506,9 @@ class PCV_OT_draw(Operator):
             if(not ok):
                 return {'CANCELLED'}
         
+        # if still loading, it will be drawn when ready
         c = PCVManager.cache[pcv.uuid]
-        c['draw'] = True
+        c.draw = True
         
         context.area.tag_redraw()
         
@@ -816,18 +2523,14 @@ class PCV_OT_erase(Operator):
     @classmethod
     def poll(cls, context):
         pcv = context.object.point_cloud_visualizer
-        ok = False
-        for k, v in PCVManager.cache.items():
-            if(v['uuid'] == pcv.uuid):
-                if(v['ready']):
-                    if(v['draw']):
-                        ok = True
-        return ok
+        v = PCVManager.cache.get(pcv.uuid)
+        # also when loading or evicted from memory, it is just not drawn anymore
+        return (v is not None and v.draw)
     
     def execute(self, context):
         pcv = context.object.point_cloud_visualizer
         c = PCVManager.cache[pcv.uuid]
-        c['draw'] = False
+        c.draw = False
         
         context.area.tag_redraw()
         
@@ -863,7 +2566,7 @@ class PCV_OT_load(Operator):
         
         if(pcv.uuid != ""):
             if(pcv.uuid in PCVManager.cache):
-                PCVManager.cache[pcv.uuid]['kill'] = True
+                PCVManager.cache[pcv.uuid].kill = True
                 PCVManager.gc()
         
         ok = load_ply_to_cache(self, context)
@@ -873,6 +2576,39 @@ class PCV_OT_load(Operator):
         return {'FINISHED'}
 
 
+class PCV_OT_stats_export(Operator):
+    bl_idname = "point_cloud_visualizer.stats_export"
+    bl_label = "Export"
+    bl_description = "Export timing and counters to JSON or CSV file, format is chosen by file extension"
+    
+    filter_glob: StringProperty(default="*.json;*.csv", options={'HIDDEN'}, )
+    filepath: StringProperty(name="File Path", default="pcv_stats.json", description="", maxlen=1024, subtype='FILE_PATH', )
+    
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+    
+    def execute(self, context):
+        if(os.path.splitext(self.filepath)[1].lower() not in ('.json', '.csv', )):
+            self.filepath = "{}.json".format(self.filepath)
+        try:
+            PCVStats.export(self.filepath)
+        except OSError as e:
+            self.report({'ERROR'}, "Unable to write '{}': {}".format(self.filepath, e))
+            return {'CANCELLED'}
+        return {'FINISHED'}
+
+
+class PCV_OT_stats_reset(Operator):
+    bl_idname = "point_cloud_visualizer.stats_reset"
+    bl_label = "Reset"
+    bl_description = "Reset timing and counters"
+    
+    def execute(self, context):
+        PCVStats.reset()
+        return {'FINISHED'}
+
+
 class PCV_OT_render(Operator):
     bl_idname = "point_cloud_visualizer.render"
     bl_label = "Render"
@@ -881,141 +2617,32 @@ class PCV_OT_render(Operator):
     @classmethod
     def poll(cls, context):
         pcv = context.object.point_cloud_visualizer
-        ok = False
-        for k, v in PCVManager.cache.items():
-            if(v['uuid'] == pcv.uuid):
-                if(v['ready']):
-                    if(v['draw']):
-                        ok = True
-        return ok
+        v = PCVManager.cache.get(pcv.uuid)
+        # cloud evicted from memory is loaded again by execute
+        return (v is not None and (v.ready or v.evicted) and v.draw)
     
     def execute(self, context):
-        bgl.glEnable(bgl.GL_PROGRAM_POINT_SIZE)
-        
         scene = context.scene
-        render = scene.render
-        image_settings = render.image_settings
-        
-        original_depth = image_settings.color_depth
-        image_settings.color_depth = '8'
-        
-        scale = render.resolution_percentage / 100
-        width = int(render.resolution_x * scale)
-        height = int(render.resolution_y * scale)
-        
         pcv = context.object.point_cloud_visualizer
-        cloud = PCVManager.cache[pcv.uuid]
-        cam = scene.camera
-        if(cam is None):
+        if(scene.camera is None):
             self.report({'ERROR'}, "No camera found.")
             return {'CANCELLED'}
+        if(not render_loaded(self, PCVManager.cache[pcv.uuid], )):
+            return {'CANCELLED'}
         
-        render_suffix = pcv.render_suffix
-        render_zeros = pcv.render_zeros
-        
-        offscreen = GPUOffScreen(width, height)
-        offscreen.bind()
+        session = PCVRenderSession(PCVManager.cache[pcv.uuid], scene, )
         try:
-            gpu.matrix.load_matrix(Matrix.Identity(4))
-            gpu.matrix.load_projection_matrix(Matrix.Identity(4))
-            
-            bgl.glClear(bgl.GL_COLOR_BUFFER_BIT)
-            
-            o = cloud['object']
-            vs = cloud['vertices']
-            cs = cloud['colors']
-            ns = cloud['normals']
-            
-            dp = pcv.render_display_percent
-            l = int((len(vs) / 100) * dp)
-            if(dp >= 99):
-                l = len(vs)
-            vs = vs[:l]
-            cs = cs[:l]
-            ns = ns[:l]
-            
-            # sort by depth
-            mw = o.matrix_world
-            depth = []
-            for i, v in enumerate(vs):
-                vw = mw @ Vector(v)
-                depth.append(world_to_camera_view(scene, cam, vw)[2])
-            zps = zip(depth, vs, cs, ns)
-            sps = sorted(zps, key=lambda a: a[0])
-            # split and reverse
-            vs = [a for _, a, b, c in sps][::-1]
-            cs = [b for _, a, b, c in sps][::-1]
-            ns = [c for _, a, b, c in sps][::-1]
-            
-            shader = GPUShader(PCVShaders.vertex_shader, PCVShaders.fragment_shader)
-            batch = batch_for_shader(shader, 'POINTS', {"position": vs, "color": cs, "normal": ns, })
-            shader.bind()
-            
-            view_matrix = cam.matrix_world.inverted()
-            camera_matrix = cam.calc_matrix_camera(bpy.context.depsgraph, x=render.resolution_x, y=render.resolution_y, scale_x=render.pixel_aspect_x, scale_y=render.pixel_aspect_y, )
-            perspective_matrix = camera_matrix @ view_matrix
-            
-            shader.uniform_float("perspective_matrix", perspective_matrix)
-            shader.uniform_float("object_matrix", o.matrix_world)
-            shader.uniform_float("point_size", pcv.render_point_size)
-            shader.uniform_float("alpha_radius", pcv.alpha_radius)
-            
-            if(pcv.light_enabled and pcv.has_normals):
-                cm = Matrix(((-1.0, 0.0, 0.0, 0.0, ), (0.0, -0.0, 1.0, 0.0, ), (0.0, -1.0, -0.0, 0.0, ), (0.0, 0.0, 0.0, 1.0, ), ))
-                _, obrot, _ = o.matrix_world.decompose()
-                mr = obrot.to_matrix().to_4x4()
-                mr.invert()
-                direction = cm @ pcv.light_direction
-                direction = mr @ direction
-                shader.uniform_float("light_direction", direction)
-                
-                inverted_direction = direction.copy()
-                inverted_direction.negate()
-                
-                c = pcv.light_intensity
-                shader.uniform_float("light_intensity", (c, c, c, ))
-                shader.uniform_float("shadow_direction", inverted_direction)
-                c = pcv.shadow_intensity
-                shader.uniform_float("shadow_intensity", (c, c, c, ))
-                shader.uniform_float("show_normals", float(pcv.show_normals))
-                shader.uniform_float("show_illumination", float(pcv.light_enabled))
-            else:
-                z = (0, 0, 0)
-                shader.uniform_float("light_direction", z)
-                shader.uniform_float("light_intensity", z)
-                shader.uniform_float("shadow_direction", z)
-                shader.uniform_float("shadow_intensity", z)
-                shader.uniform_float("show_normals", float(False))
-                shader.uniform_float("show_illumination", float(False))
-            
-            batch.draw(shader)
-            
-            buffer = bgl.Buffer(bgl.GL_BYTE, width * height * 4)
-            bgl.glReadBuffer(bgl.GL_BACK)
-            bgl.glReadPixels(0, 0, width, height, bgl.GL_RGBA, bgl.GL_UNSIGNED_BYTE, buffer)
-            
+            pixels = session.render(scene)
         except Exception as e:
             self.report({'ERROR'}, str(e))
             return {'CANCELLED'}
-            
         finally:
-            offscreen.unbind()
-            offscreen.free()
-        
-        # image from buffer
-        image_name = "pcv_output"
-        if(image_name not in bpy.data.images):
-            bpy.data.images.new(image_name, width, height)
-        image = bpy.data.images[image_name]
-        image.scale(width, height)
-        image.pixels = [v / 255 for v in buffer]
-        
-        # save as image file
-        save_render(self, scene, image, render_suffix, render_zeros, )
+            session.free()
         
-        # restore
-        image_settings.color_depth = original_depth
+        pixels_to_image("pcv_output", pixels, )
         
+        if(not save_pixels(self, scene, pixels, pcv.render_suffix, pcv.render_zeros, )):
+            return {'CANCELLED'}
         return {'FINISHED'}
 
 
@@ -1027,26 +2654,63 @@ class PCV_OT_animation(Operator):
     @classmethod
     def poll(cls, context):
         pcv = context.object.point_cloud_visualizer
-        ok = False
-        for k, v in PCVManager.cache.items():
-            if(v['uuid'] == pcv.uuid):
-                if(v['ready']):
-                    if(v['draw']):
-                        ok = True
-        return ok
+        v = PCVManager.cache.get(pcv.uuid)
+        # cloud evicted from memory is loaded again by execute
+        return (v is not None and (v.ready or v.evicted) and v.draw)
     
     def execute(self, context):
         scene = context.scene
+        pcv = context.object.point_cloud_visualizer
         
         if(scene.camera is None):
             self.report({'ERROR'}, "No camera found.")
             return {'CANCELLED'}
+        if(not render_loaded(self, PCVManager.cache[pcv.uuid], )):
+            return {'CANCELLED'}
         
         fc = scene.frame_current
-        for i in range(scene.frame_start, scene.frame_end, 1):
-            scene.frame_set(i)
-            bpy.ops.point_cloud_visualizer.render()
-        scene.frame_set(fc)
+        frames = list(range(scene.frame_start, scene.frame_end + 1, scene.frame_step, ))
+        processes = min(pcv.render_processes, len(frames), )
+        # one session for all frames, offscreen, shader and sorted points are reused, worker processes use cpu rasterizer
+        session = PCVRenderSession(PCVManager.cache[pcv.uuid], scene, processes > 1, )
+        pixels = None
+        try:
+            jobs = []
+            for i in frames:
+                scene.frame_set(i)
+                if(scene.camera is None):
+                    self.report({'ERROR'}, "No camera found at frame {}.".format(i))
+                    return {'CANCELLED'}
+                if(processes > 1):
+                    # frames are only collected here, scene can be evaluated only in this process
+                    p = render_filepath(self, scene, pcv.render_suffix, pcv.render_zeros, )
+                    if(p is None):
+                        return {'CANCELLED'}
+                    f = session.frame(scene)
+                    f['filepath'] = p
+                    jobs.append(f)
+                    continue
+                pixels = session.render(scene)
+                if(not save_pixels(self, scene, pixels, pcv.render_suffix, pcv.render_zeros, )):
+                    return {'CANCELLED'}
+            if(processes > 1):
+                errors = session.render_processes(jobs, processes, )
+                if(len(errors)):
+                    for e in errors:
+                        log("error: {}".format(e))
+                    self.report({'ERROR'}, "{} of {} render processes failed: {}".format(len(errors), processes, (errors[0].splitlines() or [''])[-1]))
+                    return {'CANCELLED'}
+        except Exception as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        finally:
+            session.free()
+            scene.frame_set(fc)
+        
+        if(pixels is not None):
+            pixels_to_image("pcv_output", pixels, )
+        fps, pps = session.throughput()
+        self.report({'INFO'}, "Rendered {} frames, {:.2f} frames/s, {} points/s, points sorted {} times.".format(session.frames, fps, human_readable_number(pps), session.sorts))
         return {'FINISHED'}
 
 
@@ -1100,6 +2764,8 @@ class PCV_PT_panel(Panel):
         r = sub.row()
         r.prop(pcv, 'point_size')
         r.enabled = e
+        r = sub.row()
+        r.prop(pcv, 'quantize_positions')
         # r = sub.row()
         # r.prop(pcv, 'alpha_radius')
         # r.enabled = e
@@ -1107,12 +2773,8 @@ class PCV_PT_panel(Panel):
         sub.separator()
         
         pcv = context.object.point_cloud_visualizer
-        ok = False
-        for k, v in PCVManager.cache.items():
-            if(v['uuid'] == pcv.uuid):
-                if(v['ready']):
-                    if(v['draw']):
-                        ok = True
+        v = PCVManager.cache.get(pcv.uuid)
+        ok = (v is not None and v.ready and v.draw)
         
         c = sub.column()
         c.prop(pcv, 'light_enabled', toggle=True, )
@@ -1148,13 +2810,47 @@ class PCV_PT_panel(Panel):
             c.separator()
             c.prop(pcv, 'render_suffix')
             c.prop(pcv, 'render_zeros')
+            c.prop(pcv, 'render_backend')
+            c.prop(pcv, 'render_processes')
             c.enabled = PCV_OT_render.poll(context)
         
+        b = sub.box()
+        r = b.row()
+        r.prop(pcv, 'stats_expanded', icon='TRIA_DOWN' if pcv.stats_expanded else 'TRIA_RIGHT', icon_only=True, emboss=False, )
+        r.label(text="Statistics")
+        if(pcv.stats_expanded):
+            st = PCVStats.report()
+            c = b.column()
+            for k, v in st['stages'].items():
+                if(v['items']):
+                    c.label(text="{}: {:.3f} ms, average {:.3f} ms, {} points ({} calls)".format(k, v['last'] * 1000, v['average'] * 1000, human_readable_number(v['items'] / v['calls']), v['calls']))
+                else:
+                    c.label(text="{}: {:.3f} ms, average {:.3f} ms ({} calls)".format(k, v['last'] * 1000, v['average'] * 1000, v['calls']))
+            c.label(text="points drawn: {}".format(human_readable_number(PCVManager.points_drawn)))
+            d = st['stages'].get('draw')
+            for k, v in st['counters'].items():
+                if(d is not None):
+                    c.label(text="{}: {} ({:.1f} per frame)".format(k, v, v / d['calls']))
+                else:
+                    c.label(text="{}: {}".format(k, v))
+            c.scale_y = 0.5
+            r = b.row(align=True)
+            r.operator('point_cloud_visualizer.stats_export')
+            r.operator('point_cloud_visualizer.stats_reset')
+        
         if(pcv.uuid in PCVManager.cache):
             r = sub.row()
             h, t = os.path.split(pcv.filepath)
-            n = human_readable_number(PCVManager.cache[pcv.uuid]['stats'])
-            r.label(text='{}: {} points'.format(t, n))
+            ci = PCVManager.cache[pcv.uuid]
+            if(ci.cloud.key in PCVLoader.jobs):
+                r.label(text='{}: loading.. {:.0f}%'.format(t, PCVLoader.jobs[ci.cloud.key].progress * 100))
+            else:
+                n = human_readable_number(ci.stats)
+                r.label(text='{}: {} points'.format(t, n))
+                if(ci.quantized):
+                    q = quantization_report(ci.chunks)
+                    r = sub.row()
+                    r.label(text='{} chunks, max error {:.3g} (bound {:.3g})'.format(len(q), max([e for _, _, e in q]), max([b for _, b, _ in q])))
         
         if(pcv.debug):
             sub.separator()
@@ -1190,9 +2886,11 @@ class PCV_PT_panel(Panel):
             c.operator('point_cloud_visualizer.gc')
             b = sub.box()
             c = b.column()
-            c.label(text="cache: {} item(s)".format(len(PCVManager.cache.items())))
+            c.label(text="cache: {} item(s), {} shared cloud(s)".format(len(PCVManager.cache.items()), len(PCVManager.clouds)))
             c.label(text="handle: {}".format(PCVManager.handle))
             c.label(text="initialized: {}".format(PCVManager.initialized))
+            cpu, gpu = PCVManager.memory()
+            c.label(text="memory: {}, gpu: {}".format(human_readable_number(cpu, 'B'), human_readable_number(gpu, 'B')))
             c.scale_y = 0.5
             
             if(len(PCVManager.cache)):
@@ -1202,48 +2900,68 @@ class PCV_PT_panel(Panel):
                     c = b.column()
                     c.scale_y = 0.5
                     for ki, vi in sorted(v.items()):
-                        if(type(vi) == np.ndarray):
+                        if(isinstance(vi, np.ndarray)):
                             c.label(text="{}: numpy.ndarray ({} items)".format(ki, len(vi)))
+                        elif(isinstance(vi, list)):
+                            c.label(text="{}: list ({} items)".format(ki, len(vi)))
                         else:
                             c.label(text="{}: {}".format(ki, vi))
+                    c.label(text="memory: {}, gpu: {}, shared by {} item(s)".format(human_readable_number(v.cloud.cpu_bytes(), 'B'), human_readable_number(v.cloud.gpu_bytes(), 'B'), len(PCVManager.users(v.cloud.key))))
+                    if(v.ready and v.batches is not None):
+                        c.label(text="chunks: {} drawn of {}".format(v.batches.drawn, len(v.chunks)))
+                    if(v.quantized and v.ready):
+                        c.label(text="quantization (points, bound, error):")
+                        for i, q in enumerate(quantization_report(v.chunks)):
+                            c.label(text="    {}: {}, {:.3g}, {:.3g}".format(i, *q))
 
 
 class PCV_properties(PropertyGroup):
     filepath: StringProperty(name="PLY file", default="", description="", )
     uuid: StringProperty(default="", options={'HIDDEN', }, )
+    
+    def _uniforms_update(self, context, ):
+        # cached uniform values of cloud are computed again on next draw
+        v = PCVManager.cache.get(self.uuid)
+        if(v is not None):
+            v.uniforms = None
+    
     # point_size: FloatProperty(name="Size", default=3.0, min=0.001, max=100.0, precision=3, subtype='FACTOR', description="Point size", )
     # point_size: IntProperty(name="Size", default=3, min=1, max=100, subtype='PIXEL', description="Point size", )
-    point_size: IntProperty(name="Size", default=3, min=1, max=10, subtype='PIXEL', description="Point size", )
-    alpha_radius: FloatProperty(name="Radius", default=1.0, min=0.001, max=1.0, precision=3, subtype='FACTOR', description="Adjust point circular discard radius", )
+    point_size: IntProperty(name="Size", default=3, min=1, max=10, subtype='PIXEL', update=_uniforms_update, description="Point size", )
+    alpha_radius: FloatProperty(name="Radius", default=1.0, min=0.001, max=1.0, precision=3, subtype='FACTOR', update=_uniforms_update, description="Adjust point circular discard radius", )
     
     def _display_percent_update(self, context, ):
         if(self.uuid not in PCVManager.cache):
             return
         d = PCVManager.cache[self.uuid]
         dp = self.display_percent
-        vl = d['length']
+        vl = d.length
         l = int((vl / 100) * dp)
         if(dp >= 99):
             l = vl
-        d['display_percent'] = l
+        d.display_percent = l
     
     display_percent: FloatProperty(name="Display", default=100.0, min=0.0, max=100.0, precision=0, subtype='PERCENTAGE', update=_display_percent_update, description="Adjust percentage of points displayed", )
+    quantize_positions: BoolProperty(name="Quantize Positions", default=False, description="Store positions as 16 bit offsets in octree chunks to save memory, takes effect on next load", )
     
     render_expanded: BoolProperty(default=False, options={'HIDDEN', }, )
+    stats_expanded: BoolProperty(default=False, options={'HIDDEN', }, )
     # render_point_size: FloatProperty(name="Size", default=3.0, min=0.001, max=100.0, precision=3, subtype='FACTOR', description="Render point size", )
     render_point_size: IntProperty(name="Size", default=3, min=1, max=100, subtype='PIXEL', description="Point size", )
     render_display_percent: FloatProperty(name="Count", default=100.0, min=0.0, max=100.0, precision=0, subtype='PERCENTAGE', description="Adjust percentage of points rendered", )
     render_suffix: StringProperty(name="Suffix", default="pcv_frame", description="Render filename or suffix, depends on render output path. Frame number will be appended automatically", )
     render_zeros: IntProperty(name="Leading Zeros", default=6, min=3, max=10, subtype='FACTOR', description="Number of leading zeros in render filename", )
+    render_processes: IntProperty(name="Processes", default=1, min=1, max=256, description="Number of processes rendering animation frames in parallel with CPU rasterizer, 1 renders in blender with selected backend", )
+    render_backend: EnumProperty(name="Backend", items=[('GPU', "GPU", "Render with OpenGL", ), ('CPU', "CPU", "Render with software rasterizer, slower, but works without GPU, always used in background mode", ), ], default='GPU', description="Render backend", )
     
     has_normals: BoolProperty(default=False)
     has_vcols: BoolProperty(default=False)
-    light_enabled: BoolProperty(name="Illumination", description="Enable extra illumination on point cloud", default=False, )
-    light_direction: FloatVectorProperty(name="Light Direction", description="Light direction", default=(0.0, 1.0, 0.0), subtype='DIRECTION', size=3, )
+    light_enabled: BoolProperty(name="Illumination", description="Enable extra illumination on point cloud", default=False, update=_uniforms_update, )
+    light_direction: FloatVectorProperty(name="Light Direction", description="Light direction", default=(0.0, 1.0, 0.0), subtype='DIRECTION', size=3, update=_uniforms_update, )
     # light_color: FloatVectorProperty(name="Light Color", description="", default=(0.2, 0.2, 0.2), min=0, max=1, subtype='COLOR', size=3, )
-    light_intensity: FloatProperty(name="Light Intensity", description="Light intensity", default=0.3, min=0, max=1, subtype='FACTOR', )
-    shadow_intensity: FloatProperty(name="Shadow Intensity", description="Shadow intensity", default=0.2, min=0, max=1, subtype='FACTOR', )
-    show_normals: BoolProperty(name="Colorize By Vertex Normals", description="", default=False, )
+    light_intensity: FloatProperty(name="Light Intensity", description="Light intensity", default=0.3, min=0, max=1, subtype='FACTOR', update=_uniforms_update, )
+    shadow_intensity: FloatProperty(name="Shadow Intensity", description="Shadow intensity", default=0.2, min=0, max=1, subtype='FACTOR', update=_uniforms_update, )
+    show_normals: BoolProperty(name="Colorize By Vertex Normals", description="", default=False, update=_uniforms_update, )
     
     debug: BoolProperty(default=DEBUG, options={'HIDDEN', }, )
     
@@ -1256,19 +2974,116 @@ class PCV_properties(PropertyGroup):
         del bpy.types.Object.point_cloud_visualizer
 
 
+def preferences():
+    # addon preferences or None if this module is not running as enabled addon (i.e. from text editor)
+    a = bpy.context.preferences.addons.get(__name__.split('.')[0])
+    if(a is None):
+        return None
+    return a.preferences
+
+
+class PCV_preferences(AddonPreferences):
+    bl_idname = __name__.split('.')[0]
+    
+    cache_enabled: BoolProperty(name="Sidecar Cache", default=True, description="Store processed point clouds on disk, so they are not parsed again on next load", )
+    cache_directory: StringProperty(name="Cache Directory", default="", subtype='DIR_PATH', description="Directory for sidecar cache files, leave empty to use directory in blender user resources", )
+    cache_size: IntProperty(name="Cache Size Limit", default=4096, min=16, subtype='UNSIGNED', description="Maximum size of sidecar cache directory in megabytes, least recently used files are removed first", )
+    point_budget: IntProperty(name="Point Budget", default=10 ** 7, min=0, subtype='UNSIGNED', description="Maximum number of points drawn in viewport redraw from all point clouds, 0 is unlimited", )
+    cpu_memory: IntProperty(name="Memory Budget", default=0, min=0, subtype='UNSIGNED', description="Maximum memory in megabytes used by point clouds, least recently drawn clouds are released first and loaded again when drawn, 0 is unlimited", )
+    gpu_memory: IntProperty(name="GPU Memory Budget", default=0, min=0, subtype='UNSIGNED', description="Maximum gpu memory in megabytes used by point clouds, least recently drawn clouds are released first and uploaded again when drawn, 0 is unlimited", )
+    navigation_budget: FloatProperty(name="While Navigating", default=0.25, min=0.01, max=1.0, precision=2, subtype='FACTOR', description="Part of point budget used while view is changing, full budget is used when view stops", )
+    
+    def draw(self, context):
+        l = self.layout
+        c = l.column()
+        c.prop(self, 'cache_enabled')
+        cc = c.column()
+        cc.prop(self, 'cache_directory')
+        cc.prop(self, 'cache_size')
+        cc.enabled = self.cache_enabled
+        c.separator()
+        c.prop(self, 'point_budget')
+        cc = c.column()
+        cc.prop(self, 'navigation_budget')
+        cc.enabled = (self.point_budget > 0)
+        c.separator()
+        c.prop(self, 'cpu_memory')
+        c.prop(self, 'gpu_memory')
+
+
 @persistent
 def watcher(scene):
+    # loaded clouds are kept until load_post, objects in new file showing unchanged files use them again
+    kept = {k: c for k, c in PCVManager.clouds.items() if c.ready}
     PCVManager.deinit()
+    # modal operator polling jobs is discarded with old window manager
+    PCVLoader.cancel()
+    PCVLoader.running = False
+    PCVManager.clouds = kept
+
+
+@persistent
+def load_watcher(scene):
+    # restore all objects with point cloud in loaded file, kept clouds are used if file did not change,
+    # anything else is loaded in background from sidecar cache or parsed again
+    for o in bpy.data.objects:
+        pcv = o.point_cloud_visualizer
+        if(pcv.filepath == ""):
+            continue
+        try:
+            ok = load_object_to_cache(None, o, )
+        except Exception as e:
+            log("unable to restore '{}': {}".format(o.name, e))
+            continue
+        if(ok):
+            PCVManager.cache[pcv.uuid].draw = True
+    # kept clouds no longer used by any object are released
+    PCVManager.gc()
+    PCVManager.objects_count = len(bpy.data.objects)
+
+
+@persistent
+def depsgraph_watcher(scene, depsgraph=None, ):
+    # objects were added or removed, check cached objects still exist
+    if(len(bpy.data.objects) != PCVManager.objects_count):
+        PCVManager.validate()
+    if(not len(PCVManager.objects)):
+        return
+    # transformed or animated objects need their uniforms again
+    if(depsgraph is None):
+        # blender 2.80 does not pass depsgraph to handlers
+        depsgraph = bpy.context.depsgraph
+    for u in depsgraph.updates:
+        if(isinstance(u.id, bpy.types.Object)):
+            v = PCVManager.objects.get(u.id.original.as_pointer())
+            if(v is not None):
+                v.uniforms = None
+
+
+@persistent
+def frame_watcher(scene):
+    # during playback depsgraph updates of animated objects are not reliably reported, any object may have moved on frame change
+    for k, v in PCVManager.cache.items():
+        v.uniforms = None
+
+
+@persistent
+def undo_watcher(scene):
+    PCVManager.validate()
 
 
 classes = (
+    PCV_preferences,
     PCV_properties,
     PCV_PT_panel,
     PCV_OT_load,
+    PCV_OT_load_progress,
     PCV_OT_draw,
     PCV_OT_erase,
     PCV_OT_render,
     PCV_OT_animation,
+    PCV_OT_stats_export,
+    PCV_OT_stats_reset,
 )
 if(DEBUG):
     classes = classes + (
@@ -1281,10 +3096,15 @@ if(DEBUG):
 def register():
     for cls in classes:
         bpy.utils.register_class(cls)
+    bpy.app.handlers.load_post.append(load_watcher)
 
 
 def unregister():
+    if(load_watcher in bpy.app.handlers.load_post):
+        bpy.app.handlers.load_post.remove(load_watcher)
     PCVManager.deinit()
+    PCVManager.clouds = {}
+    PCVShaders.clear()
     
     for cls in reversed(classes):
         bpy.utils.unregister_class(cls)